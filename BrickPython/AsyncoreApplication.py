@@ -0,0 +1,41 @@
+# AsyncoreApplication class.  Runs the BrickPiWrapper scheduler and asyncore socket handling in one event loop.
+# Applications using the BrickPi derive from this, implementing appropriate functionality.
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPiWrapper import BrickPiWrapper
+import asyncore
+import time
+
+class AsyncoreApplication(BrickPiWrapper):
+    '''
+    Main application class for apps that also serve sockets or other files, using the standard asyncore module.
+
+    The coroutines and all the asyncore dispatchers share the one thread: between work calls the application
+    waits in select() for socket activity, so there's no need for extra threads or Coroutine objects.
+
+    A dispatcher can pass data to coroutines by notifying a Notifier, for coroutines waiting using
+    Scheduler.waitForNotification.
+    '''
+
+    def __init__(self, sensorConfiguration={}, socketMap=None, boards=None):
+        '''Initialization: *sensorConfiguration* and *boards* are as passed to BrickPiWrapper.
+        *socketMap* is the asyncore map of dispatchers to serve - by default the global asyncore.socket_map.'''
+        BrickPiWrapper.__init__(self, sensorConfiguration, boards )
+        self.socketMap = asyncore.socket_map if socketMap is None else socketMap
+
+    def handleEvents(self):
+        '''Does the next work call if it's due; otherwise handles socket events until it is.
+        Returns after handling at most one batch of events.'''
+        timeoutMillis = self.timeMillisToNextCall()
+        if timeoutMillis <= 0:
+            self.doWork()
+        elif self.socketMap:
+            asyncore.loop(timeout=timeoutMillis / 1000.0, map=self.socketMap, count=1)
+        else:
+            time.sleep(timeoutMillis / 1000.0)
+
+    def mainloop(self):
+        'The main loop for the application - call this after initialization.  Never returns.'
+        while True:
+            self.handleEvents()
@@ -41,17 +41,14 @@
 
 import time
 import logging
-import os
-if os.uname()[4].startswith("arm"): # If we're on a Raspberry Pi
-    from serial import *
-    ser = Serial()
-else:                               # Mock out the serial port - it seems to work.
-    from mock import *
-    ser = Mock()
-
-#import serial
-ser.port='/dev/ttyAMA0'
-ser.baudrate = 500000
+import select
+import errno
+from Transport import createTransport
+from Clock import MonotonicClock
+
+# BrickPython amendment: the serial transport is configured (see Transport.createTransport), rather than being
+# pyserial on ARM processors and a mock elsewhere.
+ser = createTransport()
 
 # ser.writeTimeout = 0.0005
 # ser.timeout = 0.0001
@@ -116,33 +113,41 @@ INDEX_GREEN = 1
 INDEX_BLUE  = 2
 INDEX_BLANK = 3
 
-Array = [0] * 256
-BytesReceived = None
+Array = [0] * 256 # Used by AddBits and GetBits
 Bit_Offset    = 0
-Retried = 0
+MESSAGE_TIMEOUT = 0.005 # Seconds to wait for the rest of a message once it has started: 258 bytes take about 5ms.
+# Bounds in seconds for the BrickPiUpdateValues receive timeout, which adapts to the measured round trip times.
+RX_TIMEOUT_INITIAL = 0.0075
+RX_TIMEOUT_MIN = 0.0015
+RX_TIMEOUT_MAX = 0.03
+# Seconds between exchanges with a chip that would otherwise be skipped, to keep its encoder values current.
+SKIPPED_CHIP_POLL_INTERVAL = 1.0
 
 class BrickPiStruct:
-    Address = [ 1, 2 ]
-    MotorSpeed  = [0] * 4
-
-    MotorEnable = [0] * 4
-
-    EncoderOffset = [None] * 4
-    Encoder       = [None] * 4
-
-    Sensor         = [None] * 4
-    SensorArray    = [ [None] * 4 for i in range(4) ]
-    SensorType     = [0] * 4
-    SensorSettings = [ [None] * 8 for i in range(4) ]
-
-    SensorI2CDevices = [None] * 4
-    SensorI2CSpeed   = [None] * 4
-    SensorI2CAddr    = [ [None] * 8 for i in range(4) ]
-    SensorI2CWrite   = [ [None] * 8 for i in range(4) ]
-    SensorI2CRead    = [ [None] * 8 for i in range(4) ]
-    SensorI2COut     = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
-    SensorI2CIn      = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
-    Timeout = 0
+    # BrickPython amendment: the values are per instance, so that each BrickPiDriver has its own.
+    def __init__(self):
+        self.Address = [ 1, 2 ]
+        self.MotorSpeed  = [0] * 4
+
+        self.MotorEnable = [0] * 4
+
+        self.EncoderOffset = [None] * 4
+        self.Encoder       = [None] * 4
+
+        self.Sensor         = [None] * 4
+        self.SensorArray    = [ [None] * 4 for i in range(4) ]
+        self.SensorType     = [0] * 4
+        self.SensorInUse    = [True] * 4 # BrickPython amendment: a chip is skipped if neither of its sensor ports is in use and neither motor is enabled.
+        self.SensorSettings = [ [None] * 8 for i in range(4) ]
+
+        self.SensorI2CDevices = [None] * 4
+        self.SensorI2CSpeed   = [None] * 4
+        self.SensorI2CAddr    = [ [None] * 8 for i in range(4) ]
+        self.SensorI2CWrite   = [ [None] * 8 for i in range(4) ]
+        self.SensorI2CRead    = [ [None] * 8 for i in range(4) ]
+        self.SensorI2COut     = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
+        self.SensorI2CIn      = [ [ [None] * 16 for i in range(8) ] for i in range(4) ]
+        self.Timeout = 0
 BrickPi = BrickPiStruct()
 
 #PSP Mindsensors class
@@ -210,37 +215,6 @@ class button:
 		print ""
 
 
-def BrickPiChangeAddress(OldAddr, NewAddr):
-    Array[BYTE_MSG_TYPE] = MSG_TYPE_CHANGE_ADDR;
-    Array[BYTE_NEW_ADDRESS] = NewAddr;
-    BrickPiTx(OldAddr, 2, Array)
-    res, BytesReceived, InArray = BrickPiRx(0.005000)
-    if res :
-        return -1
-    for i in range(len(InArray)):
-        Array[i] = InArray[i]
-    if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_CHANGE_ADDR):
-        return -1
-    return 0
-
-def BrickPiSetTimeout():
-	for i in range(2):
-		Array[BYTE_MSG_TYPE] = MSG_TYPE_TIMEOUT_SETTINGS
-		Array[BYTE_TIMEOUT] = BrickPi.Timeout&0xFF
-		Array[BYTE_TIMEOUT + 1] = (BrickPi.Timeout / 256     ) & 0xFF
-		Array[BYTE_TIMEOUT + 2] = (BrickPi.Timeout / 65536   ) & 0xFF
-		Array[BYTE_TIMEOUT + 3] = (BrickPi.Timeout / 16777216) & 0xFF
-		BrickPiTx(BrickPi.Address[i], 5, Array)
-		res, BytesReceived, InArray = BrickPiRx(0.002500)
-		if res :
-			return -1
-		for j in range(len(InArray)):
-			Array[j] = InArray[j]
-		if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_TIMEOUT_SETTINGS):
-			return -1
-		i+=1
-	return 0
-
 def motorRotateDegree(power,deg,port,sampling_time=.1):
 	"""Rotate the selected motors by specified degre
 
@@ -319,228 +293,525 @@ def AddBits(byte_offset, bit_offset, bits, value):
     Bit_Offset += bits
 
 
-def BrickPiSetupSensors():
-    global Array
-    global Bit_Offset
-    global BytesReceived
-    for i in range(2):
+class FrameEncoder:
+    '''Packs whole bit fields into a message, least significant bit first, as AddBits does:
+    each field is shifted into an integer accumulator, which is converted to bytes in one go.'''
+    def __init__(self):
+        self.value = 0
+        self.bitCount = 0
+
+    def add(self, bits, value):
+        self.value |= (value & ((1 << bits) - 1)) << self.bitCount
+        self.bitCount += bits
+
+    def byteCount(self):
+        return (self.bitCount + 7) / 8
+
+    def writeTo(self, array, byte_offset):
+        # Stores the packed bytes in array starting at byte_offset, overwriting what's there.
+        n = self.byteCount()
+        if n:
+            packed = bytearray(('%0*x' % (2 * n, self.value)).decode('hex'))
+            packed.reverse()
+            array[byte_offset:byte_offset + n] = packed
+
+
+class FrameDecoder:
+    '''Unpacks bit fields from a received message, least significant bit first, as GetBits does.
+    Reading past the end of the data answers zeros.'''
+    def __init__(self, array, byte_offset, byte_end = None):
+        data = bytearray(array[byte_offset:byte_end])
+        data.reverse()
+        self.value = int(str(data).encode('hex') or '0', 16)
+
+    def get(self, bits):
+        result = self.value & ((1 << bits) - 1)
+        self.value >>= bits
+        return result
+
+
+# Bit widths of the values for each sensor type in a MSG_TYPE_VALUES reply.  Other types, except I2C, use SENSOR_RAW_BITS.
+SENSOR_VALUE_BITS = {
+    TYPE_SENSOR_TOUCH:           (1,),
+    TYPE_SENSOR_ULTRASONIC_CONT: (8,),
+    TYPE_SENSOR_ULTRASONIC_SS:   (8,),
+    TYPE_SENSOR_COLOR_FULL:      (3, 10, 10, 10, 10),
+}
+SENSOR_RAW_BITS = (10,)
+# Where the values after the first go in SensorArray, for TYPE_SENSOR_COLOR_FULL
+COLOR_FULL_INDEXES = (INDEX_BLANK, INDEX_RED, INDEX_GREEN, INDEX_BLUE)
+
+
+class RoundTripTimer:
+    '''Estimates the round trip time for messages to one chip, as TCP does (RFC 6298): a smoothed average plus
+    four times the smoothed deviation gives the receive timeout, within RX_TIMEOUT_MIN and RX_TIMEOUT_MAX.
+    Each retry doubles it.'''
+    def __init__(self):
+        self.smoothedTime = None
+        self.deviation = None
+        self.timeout = RX_TIMEOUT_INITIAL
+
+    def addSample(self, roundTripTime):
+        # Only use times for messages that weren't retried, since we can't tell which a reply is for.
+        if self.smoothedTime is None:
+            self.smoothedTime = roundTripTime
+            self.deviation = roundTripTime / 2
+        else:
+            self.deviation = 0.75 * self.deviation + 0.25 * abs(self.smoothedTime - roundTripTime)
+            self.smoothedTime = 0.875 * self.smoothedTime + 0.125 * roundTripTime
+        self.timeout = min(max(self.smoothedTime + 4 * self.deviation, RX_TIMEOUT_MIN), RX_TIMEOUT_MAX)
+
+    def retryTimeout(self, retries):
+        # Answers the receive timeout for a message that has been retried *retries* times.
+        return min(self.timeout * (2 ** retries), RX_TIMEOUT_MAX)
+
+def MotorField(brickPi, port):
+    # Answers the 10 bit speed, direction and enable field for a motor in a MSG_TYPE_VALUES message.
+    speed = brickPi.MotorSpeed[port]
+    direc = 0
+    if speed<0 :
+        direc = 1
+        speed *= -1
+    if speed>255:
+        speed = 255
+    return (((speed & 0xFF) << 2) | (direc << 1) | (brickPi.MotorEnable[port] & 0x01)) & 0x3FF
+
+
+class ChipPlan:
+    '''The layout of the MSG_TYPE_VALUES messages to and from one of the BrickPi chips, for one sensor configuration
+    in the BrickPiStruct *brickPi*.
+
+    Usually the message sent is just the two motor fields, so it's patched into a preallocated buffer; the reply
+    is decoded by a fixed list of steps, one per value.
+    '''
+    def __init__(self, brickPi, chip):
+        self.brickPi = brickPi
+        self.ports = (chip * 2, chip * 2 + 1)
+        #: The (port, device) of each I2C device whose write data is sent in every message
+        self.i2cWrites = [(port, device) for port in self.ports if IsI2C(brickPi.SensorType[port])
+                          for device in range(brickPi.SensorI2CDevices[port])
+                          if not (brickPi.SensorSettings[port][device] & BIT_I2C_SAME)]
+        self.txArray = bytearray([MSG_TYPE_VALUES, 0, 0, 0])
+        self.decodeSteps = [step for port in self.ports for step in SensorDecodeSteps(brickPi, port)]
+        #: Whether either of the chip's sensor ports is in use
+        self.hasSensors = any(brickPi.SensorInUse[port] for port in self.ports)
+        #: Whether either motor was enabled in the last message the chip received
+        self.motorsEnabled = False
+        #: Monotonic time in seconds of the latest successful exchange, or None if there hasn't been one
+        self.lastExchangeTime = None
+        # The number of bits of sensor values in a reply: at least the device mask for I2C sensors.
+        self.sensorBits = sum(brickPi.SensorI2CDevices[port] if IsI2C(brickPi.SensorType[port])
+                              else sum(SENSOR_VALUE_BITS.get(brickPi.SensorType[port], SENSOR_RAW_BITS))
+                              for port in self.ports)
+
+    def inUse(self, timeNow):
+        # Answers whether the chip needs a message: if it has sensors, or motors that are or were enabled,
+        # or an encoder offset to set - or its encoders haven't been read for SKIPPED_CHIP_POLL_INTERVAL.
+        BrickPi = self.brickPi
+        port1, port2 = self.ports
+        return (self.hasSensors or self.motorsEnabled or BrickPi.MotorEnable[port1] or BrickPi.MotorEnable[port2]
+                or BrickPi.EncoderOffset[port1] or BrickPi.EncoderOffset[port2]
+                or self.lastExchangeTime is None or timeNow - self.lastExchangeTime >= SKIPPED_CHIP_POLL_INTERVAL)
+
+    def encode(self):
+        # Answers the number of bytes of the message to send, and the array containing it.
+        BrickPi = self.brickPi
+        port1, port2 = self.ports
+        if not (self.i2cWrites or BrickPi.EncoderOffset[port1] or BrickPi.EncoderOffset[port2]):
+            # Two zero bits for 'no encoder offset', then the motor fields.
+            value = (MotorField(BrickPi, port1) << 2) | (MotorField(BrickPi, port2) << 12)
+            self.txArray[1] = value & 0xFF
+            self.txArray[2] = (value >> 8) & 0xFF
+            self.txArray[3] = value >> 16
+            return 4, self.txArray
+
+        encoder = FrameEncoder()
+        for port in self.ports:
+            offset = BrickPi.EncoderOffset[port]
+            if offset:
+                encoder.add(1, 1)
+                direction = 1 if offset < 0 else 0
+                offset = abs(offset)
+                bitsNeeded = BitsNeeded(offset) + 1
+                encoder.add(5, bitsNeeded)
+                encoder.add(bitsNeeded, (offset * 2) | direction)
+            else:
+                encoder.add(1, 0)
+        for port in self.ports:
+            encoder.add(10, MotorField(BrickPi, port))
+        for port, device in self.i2cWrites:
+            encoder.add(4, BrickPi.SensorI2CWrite[port][device])
+            encoder.add(4, BrickPi.SensorI2CRead[port][device])
+            for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
+                encoder.add(8, BrickPi.SensorI2COut[port][device][out_byte])
+        array = bytearray(1 + encoder.byteCount())
+        array[0] = MSG_TYPE_VALUES
+        encoder.writeTo(array, 1)
+        return len(array), array
+
+    def replyFits(self, inArray):
+        # Answers whether a MSG_TYPE_VALUES reply is long enough to hold the encoder and sensor values for this chip.
+        # A reply meant for the other chip, with different sensors or encoder values, may not be.
+        if len(inArray) < 3:
+            return False
+        decoder = FrameDecoder(inArray, 1, 3)
+        bits = 10 + decoder.get(5) + decoder.get(5) + self.sensorBits
+        return len(inArray) >= 1 + (bits + 7) / 8
+
+    def decode(self, inArray):
+        # Sets the encoder and sensor values in the BrickPi structure from a reply.
+        decoder = FrameDecoder(inArray, 1)
+        bitsUsed = (decoder.get(5), decoder.get(5))
+        for port, bits in zip(self.ports, bitsUsed):
+            value = decoder.get(bits)
+            self.brickPi.Encoder[port] = -(value / 2) if value & 0x01 else value / 2
+        for step in self.decodeSteps:
+            step(decoder)
+
+
+def IsI2C(sensorType):
+    return sensorType == TYPE_SENSOR_I2C or sensorType == TYPE_SENSOR_I2C_9V
+
+
+def SensorDecodeSteps(BrickPi, port):
+    # Answers a list of functions, each decoding one of the sensor's values from a FrameDecoder into BrickPi.
+    sensorType = BrickPi.SensorType[port]
+    if IsI2C(sensorType):
+        def decodeI2C(decoder):
+            BrickPi.Sensor[port] = decoder.get(BrickPi.SensorI2CDevices[port])
+            for device in range(BrickPi.SensorI2CDevices[port]):
+                if (BrickPi.Sensor[port] & ( 0x01 << device)) :
+                    for in_byte in range(BrickPi.SensorI2CRead[port][device]):
+                        BrickPi.SensorI2CIn[port][device][in_byte] = decoder.get(8)
+        return [decodeI2C]
+    fieldBits = SENSOR_VALUE_BITS.get(sensorType, SENSOR_RAW_BITS)
+    def decodeValue(decoder, bits = fieldBits[0]):
+        BrickPi.Sensor[port] = decoder.get(bits)
+    def decodeArrayValue(index, bits):
+        def decode(decoder):
+            BrickPi.SensorArray[port][index] = decoder.get(bits)
+        return decode
+    return [decodeValue] + [decodeArrayValue(index, bits) for index, bits in zip(COLOR_FULL_INDEXES, fieldBits[1:])]
+
+
+class FramePlan:
+    '''The ChipPlans for both chips, for the sensor configuration in the BrickPiStruct *brickPi* when it was created.
+    setupSensors creates a new one; updateValues also does if the SensorTypes or SensorInUse have changed.'''
+    def __init__(self, brickPi):
+        self.sensorTypes = list(brickPi.SensorType)
+        self.sensorInUse = list(brickPi.SensorInUse)
+        self.chips = [ChipPlan(brickPi, i) for i in range(2)]
+
+
+class FrameReassembler:
+    '''Assembles a received message - checksum, length, then that many bytes of data - from the bytes received,
+    however the UART splits them up.  A message may start after some garbage: bytes are skipped only if they
+    can't start a message, which must have some data, starting with the expected message type if it's known.'''
+    def __init__(self):
+        self.buffer = bytearray(256 + 2)
+        self.byteCount = 0
+
+    def reset(self):
+        self.byteCount = 0
+
+    def add(self, data):
+        self.buffer[self.byteCount:self.byteCount+len(data)] = data
+        self.byteCount += len(data)
+
+    def message(self, msgType = None):
+        # Answers 0 and the message data if a complete valid message of type msgType (if given) has been received;
+        # otherwise the BrickPiRx error code for what's been received so far, and None.
+        # The data is a copy, a bytearray: a memoryview of the buffer would index as strings in Python 2.
+        buf = self.buffer
+        n = self.byteCount
+        for start in range(n - 1):
+            length = buf[start + 1]
+            if length == 0 and (start > 0 or msgType is not None):
+                continue # Two zero bytes after garbage would otherwise look like an empty message.
+            if msgType is not None and start + 2 < n and buf[start + 2] != msgType:
+                continue
+            end = start + length + 2
+            if end > n :
+                return -6, None
+            if sum(buf[start+1:end]) % 256 == buf[start] : #Checksum equals sum(InArray)+len(InArray)
+                return 0, buf[start+2:end]
+            return -5, None # A complete message with the wrong checksum: don't look for others inside it.
+        if n < 2 :
+            return -4, None
+        return -5, None
+
+
+class BrickPiDriver:
+    '''BrickPython amendment: communicates with one BrickPi board through the serial port *port*.
+
+    Each driver has its own BrickPiStruct (*brickPi*, or a new one), message buffers, frame plan and round trip
+    timers, so there can be several, one for each board.  A driver must only be used by one thread at a time.
+    The module functions (BrickPiSetup, BrickPiUpdateValues etc.) use the default driver, Driver.
+    '''
+    def __init__(self, port, brickPi = None):
+        #: The serial port
+        self.ser = port
+        #: The BrickPiStruct holding the values to send and the values received
+        self.brickPi = brickPi if brickPi is not None else BrickPiStruct()
+        #: The FramePlan for the current sensor configuration
+        self.plan = None
+        #: Number of times the current message has been retried
+        self.retried = 0
+        #: A RoundTripTimer for each chip
+        self.roundTripTimers = [RoundTripTimer(), RoundTripTimer()]
+        #: Whether the latest updateValues skipped each chip, as it wasn't in use: it keeps its previous values.
+        #: (Chips whose exchanges failed aren't skipped.)
+        self.chipsSkipped = [False, False]
+        self.txBuffer = bytearray(256 + 3) # Reused for every message sent: address, checksum, length, then the data
+        self.txView = memoryview(self.txBuffer) # Slices of it are written without copying the message.
+        self.reassembler = FrameReassembler()
+
+    def setup(self):
+        ser = self.ser
+        if ser.isOpen():
+            return -1
+        ser.open()
+        if not ser.isOpen():
+            return -1
+        return 0
+
+    def changeAddress(self, OldAddr, NewAddr):
         Array = [0] * 256
-        Bit_Offset = 0
-        Array[BYTE_MSG_TYPE] = MSG_TYPE_SENSOR_TYPE
-        Array[BYTE_SENSOR_1_TYPE] = BrickPi.SensorType[PORT_1 + i*2 ]
-        Array[BYTE_SENSOR_2_TYPE] = BrickPi.SensorType[PORT_2 + i*2 ]
-        for ii in range(2):
-            port = i*2 + ii
-            if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C or Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C_9V ):
-                AddBits(3,0,8,BrickPi.SensorI2CSpeed[port])
-
-                if(BrickPi.SensorI2CDevices[port] > 8):
-                    BrickPi.SensorI2CDevices[port] = 8
-
-                if(BrickPi.SensorI2CDevices[port] == 0):
-                    BrickPi.SensorI2CDevices[port] = 1
-
-                AddBits(3,0,3, (BrickPi.SensorI2CDevices[port] - 1))
-
-                for device in range(BrickPi.SensorI2CDevices[port]):
-                    AddBits(3,0,7, (BrickPi.SensorI2CAddr[port][device] >> 1))
-                    AddBits(3,0,2, BrickPi.SensorSettings[port][device])
-                    if(BrickPi.SensorSettings[port][device] & BIT_I2C_SAME):
-                        AddBits(3,0,4, BrickPi.SensorI2CWrite[port][device])
-                        AddBits(3,0,4, BrickPi.SensorI2CRead[port][device])
-
-                        for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
-                            AddBits(3,0,8, BrickPi.SensorI2COut[port][device][out_byte])
-
-        tx_bytes = (((Bit_Offset + 7) / 8) + 3) #eq to UART_TX_BYTES
-        BrickPiTx(BrickPi.Address[i], tx_bytes , Array)
-        res, BytesReceived, InArray = BrickPiRx(0.500000)
+        Array[BYTE_MSG_TYPE] = MSG_TYPE_CHANGE_ADDR;
+        Array[BYTE_NEW_ADDRESS] = NewAddr;
+        self.tx(OldAddr, 2, Array)
+        res, BytesReceived, InArray = self.rx(0.005000, MSG_TYPE_CHANGE_ADDR)
         if res :
             return -1
-        for i in range(len(InArray)):
-            Array[i]=InArray[i]
-        if not (BytesReceived ==1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_SENSOR_TYPE) :
+        Array[:len(InArray)] = InArray
+        if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_CHANGE_ADDR):
             return -1
-    return 0
-
-
-def BrickPiUpdateValues():
-    global Array
-    global Bit_Offset
-    global Retried
-    ret = False
-    i = 0
-    while i < 2 :
-        if not ret:
-            Retried = 0
-        #Retry Communication from here, if failed
+        return 0
 
+    def setTimeout(self):
+        BrickPi = self.brickPi
         Array = [0] * 256
-        Array[BYTE_MSG_TYPE] = MSG_TYPE_VALUES
-        Bit_Offset = 0
-
-        for ii in range(2):
-            port = (i * 2) + ii
-            if(BrickPi.EncoderOffset[port]):
-                Temp_Value = BrickPi.EncoderOffset[port]
-                AddBits(1,0,1,1)
-                if Temp_Value < 0 :
-                    Temp_ENC_DIR = 1
-                    Temp_Value *= -1
-                Temp_BitsNeeded = BitsNeeded(Temp_Value) + 1
-                AddBits(1,0,5, Temp_BitsNeeded)
-                Temp_Value *= 2
-                Temp_Value |= Temp_ENC_DIR
-                AddBits(1,0, Temp_BitsNeeded, Temp_Value)
-            else:
-                AddBits(1,0,1,0)
-
-
-        for ii in range(2):
-            port = (i *2) + ii
-            speed = BrickPi.MotorSpeed[port]
-            direc = 0
-            if speed<0 :
-                direc = 1
-                speed *= -1
-            if speed>255:
-                speed = 255
-            AddBits(1,0,10,((((speed & 0xFF) << 2) | (direc << 1) | (BrickPi.MotorEnable[port] & 0x01)) & 0x3FF))
-
-
-        for ii in range(2):
-            port =  (i * 2) + ii
-            if(BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V):
-                for device in range(BrickPi.SensorI2CDevices[port]):
-                    if not (BrickPi.SensorSettings[port][device] & BIT_I2C_SAME):
-                        AddBits(1,0,4, BrickPi.SensorI2CWrite[port][device])
-                        AddBits(1,0,4, BrickPi.SensorI2CRead[port][device])
-                        for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
-                            AddBits(1,0,8, BrickPi.SensorI2COut[port][device][out_byte])
-                    device += 1
-
-
-        tx_bytes = (((Bit_Offset + 7) / 8 ) + 1) #eq to UART_TX_BYTES
-        BrickPiTx(BrickPi.Address[i], tx_bytes, Array)
-
-        result, BytesReceived, InArray = BrickPiRx(0.007500) #check timeout
-        for j in range(len(InArray)):
-            Array[j]=InArray[j]
-
-        if result != -2 :
-            BrickPi.EncoderOffset[(i * 2) + PORT_A] = 0
-            BrickPi.EncoderOffset[(i * 2) + PORT_B] = 0
-
-        if (result or (Array[BYTE_MSG_TYPE] != MSG_TYPE_VALUES)):
-            logging.debug( "BrickPiRxError: %d" % result )
-
-            if Retried < 2 :
-                ret = True
-                Retried += 1
-                #print "Retry", Retried
-                continue
-            else:
-                logging.debug("BrickPiRx - all retried failed")
+        for i in range(2):
+            Array[BYTE_MSG_TYPE] = MSG_TYPE_TIMEOUT_SETTINGS
+            Array[BYTE_TIMEOUT] = BrickPi.Timeout&0xFF
+            Array[BYTE_TIMEOUT + 1] = (BrickPi.Timeout / 256     ) & 0xFF
+            Array[BYTE_TIMEOUT + 2] = (BrickPi.Timeout / 65536   ) & 0xFF
+            Array[BYTE_TIMEOUT + 3] = (BrickPi.Timeout / 16777216) & 0xFF
+            self.tx(BrickPi.Address[i], 5, Array)
+            res, BytesReceived, InArray = self.rx(0.002500, MSG_TYPE_TIMEOUT_SETTINGS)
+            if res :
                 return -1
+            Array[:len(InArray)] = InArray
+            if not (BytesReceived == 1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_TIMEOUT_SETTINGS):
+                return -1
+        return 0
+
+    def planFrames(self):
+        # Answers the FramePlan for the current sensor configuration, creating it if need be.
+        BrickPi = self.brickPi
+        plan = self.plan
+        if plan is None or plan.sensorTypes != BrickPi.SensorType or plan.sensorInUse != BrickPi.SensorInUse:
+            plan = self.plan = FramePlan(BrickPi)
+        return plan
+
+    def setupSensors(self):
+        BrickPi = self.brickPi
+        self.plan = None
+        for i in range(2):
+            Array = [0] * 256
+            Array[BYTE_MSG_TYPE] = MSG_TYPE_SENSOR_TYPE
+            Array[BYTE_SENSOR_1_TYPE] = BrickPi.SensorType[PORT_1 + i*2 ]
+            Array[BYTE_SENSOR_2_TYPE] = BrickPi.SensorType[PORT_2 + i*2 ]
+            encoder = FrameEncoder()
+            for ii in range(2):
+                port = i*2 + ii
+                if(Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C or Array[BYTE_SENSOR_1_TYPE + ii] == TYPE_SENSOR_I2C_9V ):
+                    encoder.add(8, BrickPi.SensorI2CSpeed[port])
+
+                    if(BrickPi.SensorI2CDevices[port] > 8):
+                        BrickPi.SensorI2CDevices[port] = 8
+
+                    if(BrickPi.SensorI2CDevices[port] == 0):
+                        BrickPi.SensorI2CDevices[port] = 1
+
+                    encoder.add(3, (BrickPi.SensorI2CDevices[port] - 1))
+
+                    for device in range(BrickPi.SensorI2CDevices[port]):
+                        encoder.add(7, (BrickPi.SensorI2CAddr[port][device] >> 1))
+                        encoder.add(2, BrickPi.SensorSettings[port][device])
+                        if(BrickPi.SensorSettings[port][device] & BIT_I2C_SAME):
+                            encoder.add(4, BrickPi.SensorI2CWrite[port][device])
+                            encoder.add(4, BrickPi.SensorI2CRead[port][device])
+
+                            for out_byte in range(BrickPi.SensorI2CWrite[port][device]):
+                                encoder.add(8, BrickPi.SensorI2COut[port][device][out_byte])
+
+            encoder.writeTo(Array, 3)
+            if i == 1: # The I2C device counts are now valid.
+                self.plan = FramePlan(BrickPi)
+            tx_bytes = encoder.byteCount() + 3 #eq to UART_TX_BYTES
+            self.tx(BrickPi.Address[i], tx_bytes , Array)
+            res, BytesReceived, InArray = self.rx(0.500000, MSG_TYPE_SENSOR_TYPE)
+            if res :
+                return -1
+            Array[:len(InArray)] = InArray
+            if not (BytesReceived ==1 and Array[BYTE_MSG_TYPE] == MSG_TYPE_SENSOR_TYPE) :
+                return -1
+        return 0
 
-
+    def updateValues(self):
+        BrickPi = self.brickPi
+        plan = self.planFrames()
+        timeNow = MonotonicClock.monotonicTime()
+        self.chipsSkipped = [False, False]
         ret = False
-        Bit_Offset = 0
+        i = 0
+        while i < 2 :
+            if not ret:
+                self.retried = 0
+            #Retry Communication from here, if failed
+
+            chip = plan.chips[i]
+            if not chip.inUse(timeNow):
+                self.chipsSkipped[i] = True
+                i += 1
+                continue
+            tx_bytes, txArray = chip.encode()
+            self.discardInput()
+            txTime = MonotonicClock.monotonicTime()
+            self.tx(BrickPi.Address[i], tx_bytes, txArray)
 
-        Temp_BitsUsed = []
-        Temp_BitsUsed.append(GetBits(1,0,5))
-        Temp_BitsUsed.append(GetBits(1,0,5))
+            result, BytesReceived, InArray = self.rx(self.roundTripTimers[i].retryTimeout(self.retried), MSG_TYPE_VALUES)
 
-        for ii in range(2):
-            Temp_EncoderVal = GetBits(1,0, Temp_BitsUsed[ii])
-            if Temp_EncoderVal & 0x01 :
-                Temp_EncoderVal /= 2
-                BrickPi.Encoder[ii + i*2] = Temp_EncoderVal*(-1)
-            else:
-                BrickPi.Encoder[ii + i*2] = Temp_EncoderVal / 2
-
-
-        for ii in range(2):
-            port = ii + (i * 2)
-            if BrickPi.SensorType[port] == TYPE_SENSOR_TOUCH :
-                BrickPi.Sensor[port] = GetBits(1,0,1)
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_CONT or BrickPi.SensorType[port] == TYPE_SENSOR_ULTRASONIC_SS :
-                BrickPi.Sensor[port] = GetBits(1,0,8)
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_COLOR_FULL:
-                BrickPi.Sensor[port] = GetBits(1,0,3)
-                BrickPi.SensorArray[port][INDEX_BLANK] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_RED] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_GREEN] = GetBits(1,0,10)
-                BrickPi.SensorArray[port][INDEX_BLUE] = GetBits(1,0,10)
-            elif BrickPi.SensorType[port] == TYPE_SENSOR_I2C or BrickPi.SensorType[port] == TYPE_SENSOR_I2C_9V :
-                BrickPi.Sensor[port] = GetBits(1,0, BrickPi.SensorI2CDevices[port])
-                for device in range(BrickPi.SensorI2CDevices[port]):
-                    if (BrickPi.Sensor[port] & ( 0x01 << device)) :
-                        for in_byte in range(BrickPi.SensorI2CRead[port][device]):
-                            BrickPi.SensorI2CIn[port][device][in_byte] = GetBits(1,0,8)
-            else:   #For all the light, color and raw sensors
-                BrickPi.Sensor[ii + (i * 2)] = GetBits(1,0,10)
-
-        i += 1
-    return 0
+            if result != -2 :
+                BrickPi.EncoderOffset[(i * 2) + PORT_A] = 0
+                BrickPi.EncoderOffset[(i * 2) + PORT_B] = 0
 
+            if (result or not InArray or (InArray[BYTE_MSG_TYPE] != MSG_TYPE_VALUES) or not chip.replyFits(InArray)):
+                logging.debug( "BrickPiRxError: %d" % result )
 
-def BrickPiSetup():
-    if ser.isOpen():
-        return -1
-    ser.open()
-    if not ser.isOpen():
-        return -1
-    return 0
+                if self.retried < 2 :
+                    ret = True
+                    self.retried += 1
+                    #print "Retry", Retried
+                    continue
+                else:
+                    logging.debug("BrickPiRx - all retried failed")
+                    return -1
 
 
-def BrickPiTx(dest, ByteCount, OutArray):
-    tx_buffer = ''
-    tx_buffer+=chr(dest)
-    tx_buffer+=chr((dest+ByteCount+sum(OutArray[:ByteCount]))%256)
-    tx_buffer+=chr(ByteCount)
-    for i in OutArray[:ByteCount]:
-        tx_buffer+=chr(i)
-    ser.write(tx_buffer)
-
-
-def BrickPiRx(timeout):
-    rx_buffer = ''
-    ser.timeout=0
-    ot = time.time()
-
-    while( ser.inWaiting() <= 0):
-        if time.time() - ot >= timeout :
+            if self.retried == 0:
+                self.roundTripTimers[i].addSample(max(MonotonicClock.monotonicTime() - txTime, 0))
+            else:
+                # Replies to the earlier attempts may still be on their way; they mustn't be taken for the next chip's.
+                self.discardLateReplies(self.roundTripTimers[i].retryTimeout(self.retried))
+            ret = False
+            chip.motorsEnabled = bool(BrickPi.MotorEnable[i * 2] or BrickPi.MotorEnable[i * 2 + 1])
+            chip.decode(InArray)
+            chip.lastExchangeTime = timeNow
+            i += 1
+        return 0
+
+    def discardInput(self):
+        # Discards anything received but not yet read: late replies to earlier messages.
+        ser = self.ser
+        while ser.inWaiting():
+            ser.read(ser.inWaiting())
+
+    def discardLateReplies(self, timeout):
+        # Discards input until none has arrived for timeout seconds.
+        while self.ser.isOpen() and self.waitForInput(timeout):
+            self.discardInput()
+
+    def tx(self, dest, ByteCount, OutArray):
+        TxBuffer = self.txBuffer
+        TxBuffer[0] = dest
+        TxBuffer[1] = (dest+ByteCount+sum(OutArray[:ByteCount]))%256
+        TxBuffer[2] = ByteCount
+        TxBuffer[3:3+ByteCount] = OutArray[:ByteCount]
+        self.ser.write(self.txView[:ByteCount+3])
+
+    def waitForInput(self, timeout):
+        # Waits up to timeout seconds for input on the serial port, answering whether there is some.
+        # Blocks in select() if the port has a file descriptor, so it uses no CPU while waiting;
+        # otherwise (e.g. a LoopbackTransport) it polls.
+        ser = self.ser
+        try:
+            fd = ser.fileno()
+        except Exception:
+            fd = None
+        if not isinstance(fd, int):
+            ot = MonotonicClock.monotonicTime()
+            while( ser.inWaiting() <= 0):
+                if MonotonicClock.monotonicTime() - ot >= timeout :
+                    return False
+            return True
+        deadline = MonotonicClock.monotonicTime() + timeout
+        while True:
+            try:
+                readable, _, _ = select.select([fd], [], [], max(deadline - MonotonicClock.monotonicTime(), 0))
+                return bool(readable)
+            except select.error as e:
+                if e.args[0] != errno.EINTR: # Interrupted by a signal - wait for the rest of the time.
+                    raise
+
+    def rx(self, timeout, msgType = None):
+        # Answers the result, the number of data bytes, and a bytearray of the data received.
+        # Once a reply starts, keeps receiving until it's complete, for up to the timeout or MESSAGE_TIMEOUT.
+        ser = self.ser
+        ser.timeout=0
+        startTime = MonotonicClock.monotonicTime()
+
+        if not ser.isOpen():
+            return -1, 0 , []
+
+        if not self.waitForInput(timeout):
             return -2, 0 , []
 
-    if not ser.isOpen():
-        return -1, 0 , []
+        deadline = max(startTime + timeout, MonotonicClock.monotonicTime() + MESSAGE_TIMEOUT)
+        reassembler = self.reassembler
+        reassembler.reset()
+        while True:
+            try:
+                while ser.inWaiting():
+                    reassembler.add(ser.read(ser.inWaiting()))
+                    #time.sleep(.000075)
+            except:
+                return -1, 0 , []
 
-    try:
-        while ser.inWaiting():
-            rx_buffer += ( ser.read(ser.inWaiting()) )
-            #time.sleep(.000075)
-    except:
-        return -1, 0 , []
+            result, data = reassembler.message(msgType)
+            if result == 0:
+                return 0, len(data), data
+            if not self.waitForInput(max(deadline - MonotonicClock.monotonicTime(), 0)):
+                return result, 0 , []
 
-    RxBytes=len(rx_buffer)
 
-    if RxBytes < 2 :
-        return -4, 0 , []
+#: The default driver, for the board on ser, used by the module functions below.
+Driver = BrickPiDriver(ser, BrickPi)
 
-    if RxBytes < ord(rx_buffer[1])+2 :
-        return -6, 0 , []
+def BrickPiChangeAddress(OldAddr, NewAddr):
+    return Driver.changeAddress(OldAddr, NewAddr)
+
+def BrickPiSetTimeout():
+    return Driver.setTimeout()
+
+def BrickPiPlanFrames():
+    return Driver.planFrames()
+
+def BrickPiSetupSensors():
+    return Driver.setupSensors()
 
-    CheckSum = 0
-    for i in rx_buffer[1:]:
-        CheckSum += ord(i)
+def BrickPiUpdateValues():
+    return Driver.updateValues()
 
-    InArray = []
-    for i in rx_buffer[2:]:
-        InArray.append(ord(i))
-    if (CheckSum % 256) != ord(rx_buffer[0]) : #Checksum equals sum(InArray)+len(InArray)
-        return -5, 0 , []
+def BrickPiSetup():
+    return Driver.setup()
+
+def BrickPiTx(dest, ByteCount, OutArray):
+    Driver.tx(dest, ByteCount, OutArray)
 
-    InBytes = RxBytes - 2
+def WaitForInput(timeout):
+    return Driver.waitForInput(timeout)
 
-    return 0, InBytes, InArray
+def BrickPiRx(timeout, msgType = None):
+    return Driver.rx(timeout, msgType)
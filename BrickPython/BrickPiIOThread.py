@@ -0,0 +1,148 @@
+# BrickPiIOThread
+# Background thread that exchanges values with the BrickPi, so the serial communication overlaps the coroutines.
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+import threading
+import logging
+import BrickPi as BP
+from Scheduler import Scheduler
+from Coroutine import logException
+
+class BrickPiCommands():
+    'Snapshot of the motor settings to send to the BrickPi: lists indexed by motor port.'
+    def __init__(self, motorEnable, motorSpeed):
+        self.motorEnable = motorEnable
+        self.motorSpeed = motorSpeed
+
+    def copyTo(self, brickPi):
+        'Sets the motor settings in the BrickPiStruct *brickPi*.'
+        brickPi.MotorEnable[:] = self.motorEnable
+        brickPi.MotorSpeed[:] = self.motorSpeed
+
+class BrickPiSample():
+    'Snapshot of the values received from the BrickPi in one exchange: lists indexed by port.'
+    def __init__(self, timeMillis, encoders, sensors, encodersCurrent = None):
+        #: Time the values were received
+        self.timeMillis = timeMillis
+        #: Motor encoder positions
+        self.encoders = encoders
+        #: Whether each encoder position is current: False if the exchange skipped its chip, so it may be old.
+        self.encodersCurrent = encodersCurrent if encodersCurrent is not None else [True] * len(encoders)
+        #: Sensor values
+        self.sensors = sensors
+
+    @staticmethod
+    def fromBrickPi(timeMillis, driver = None):
+        '''Answers a sample with the values from the latest updateValues of the BrickPiDriver *driver*
+        (by default, the one used by BrickPiUpdateValues).'''
+        if driver is None:
+            driver = BP.Driver
+        brickPi = driver.brickPi
+        def intOrZero(value): # Values aren't set if the communication failed (e.g. on a Mac).
+            return value if isinstance(value, (int, long)) else 0
+        return BrickPiSample(timeMillis, [intOrZero(v) for v in brickPi.Encoder], [intOrZero(v) for v in brickPi.Sensor],
+                             [not driver.chipsSkipped[port / 2] for port in range(4)])
+
+class BrickPiIOThread(threading.Thread):
+    '''Thread that repeatedly exchanges values with the BrickPi using *driver* (by default BrickPi.Driver),
+    every *intervalMillis*.
+
+    The state is double buffered: the Scheduler thread sets a new BrickPiCommands snapshot, and reads the latest
+    BrickPiSample, without waiting for the serial communication.  Each snapshot is replaced, never changed, and
+    assigning a reference is atomic, so only the list of samples needs a lock.
+    Once started, only this thread may use the driver.
+
+    The thread can run faster than the Scheduler's work calls, oversampling the sensors and motor positions:
+    takeSamples answers all the samples (up to *maxSamples*) since the previous call.
+    '''
+    def __init__(self, intervalMillis = 10, maxSamples = 100, driver = None):
+        threading.Thread.__init__(self, name = "BrickPiIO")
+        self.daemon = True
+        self.driver = driver if driver is not None else BP.Driver
+        self.intervalMillis = intervalMillis
+        self.logger = logging
+        #: Latest commands to send, set by the Scheduler thread
+        self.commands = None
+        #: Latest values received, or None before the first exchange completes
+        self.latestSample = None
+        self.maxSamples = maxSamples
+        self.samples = []
+        self.samplesLock = threading.Lock()
+        self.stopEvent = threading.Event()
+
+    def setCommands(self, commands):
+        'Sets the BrickPiCommands to send from the next exchange on.'
+        self.commands = commands
+
+    def takeSamples(self):
+        'Answers a list of the BrickPiSamples received since the last call, oldest first.'
+        with self.samplesLock:
+            samples, self.samples = self.samples, []
+        return samples
+
+    def run(self):
+        while not self.stopEvent.is_set():
+            startTime = Scheduler.currentTimeMillis()
+            commands = self.commands
+            if commands is not None:
+                commands.copyTo(self.driver.brickPi)
+            try:
+                self.driver.updateValues()
+            except Exception as e:
+                logException(self.logger, e)
+            sample = BrickPiSample.fromBrickPi(Scheduler.currentTimeMillis(), self.driver)
+            with self.samplesLock:
+                self.samples.append(sample)
+                if len(self.samples) > self.maxSamples: # Nobody is taking them.
+                    del self.samples[0]
+            self.latestSample = sample
+            timeToWait = self.intervalMillis - (Scheduler.currentTimeMillis() - startTime)
+            if timeToWait > 0:
+                self.stopEvent.wait(timeToWait / 1000.0)
+
+    def stop(self):
+        'Stops the thread, waiting for the current exchange to finish.'
+        self.stopEvent.set()
+        self.join()
+
+class BrickPiExchangeThread(threading.Thread):
+    '''Thread that does a single exchange with the BrickPi using *driver* whenever asked, so that the exchanges
+    with several boards can overlap: beginExchange starts one, and endExchange waits for it to finish.
+    Between the two, only this thread may use the driver.
+    '''
+    def __init__(self, driver):
+        threading.Thread.__init__(self, name = "BrickPiExchange")
+        self.daemon = True
+        self.driver = driver
+        self.logger = logging
+        self.requested = threading.Event()
+        self.finished = threading.Event()
+        self.stopping = False
+
+    def beginExchange(self):
+        'Starts an exchange.'
+        self.finished.clear()
+        self.requested.set()
+
+    def endExchange(self):
+        'Waits for the exchange started by beginExchange to finish.'
+        self.finished.wait()
+
+    def run(self):
+        while True:
+            self.requested.wait()
+            self.requested.clear()
+            if self.stopping:
+                return
+            try:
+                self.driver.updateValues()
+            except Exception as e:
+                logException(self.logger, e)
+            self.finished.set()
+
+    def stop(self):
+        'Stops the thread, waiting for the current exchange to finish.'
+        self.stopping = True
+        self.requested.set()
+        self.join()
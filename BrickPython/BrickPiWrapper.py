@@ -6,6 +6,74 @@ from Motor import Motor
 from Sensor import Sensor
 import BrickPi as BP
 from Scheduler import Scheduler
+from BrickPiIOThread import BrickPiIOThread, BrickPiExchangeThread, BrickPiCommands, BrickPiSample
+
+class BrickPiBoard():
+    '''One of the BrickPi boards used by a BrickPiWrapper: its BrickPiDriver, and the motors and sensors connected to it.
+    Boards are numbered from 1.'''
+    def __init__(self, driver, number):
+        #: The BrickPiDriver communicating with the board
+        self.driver = driver
+        self.number = number
+        #: Map from port number to Motor
+        self.motors = {}
+        #: Map from port number to Sensor
+        self.sensors = {}
+        #: The BrickPiIOThread doing the communication, or None if updates do it directly.
+        self.ioThread = None
+        self.exchangeThread = None # Used by direct updates, for all but the first board.
+
+    def portName(self, idChar):
+        'Answers the name of a port on the board, e.g. "A", or "2:A" for boards other than the first.'
+        return idChar if self.number == 1 else '%d:%s' % (self.number, idChar)
+
+    def motorCommands(self):
+        # Answers a BrickPiCommands with the current motor settings.
+        motorEnable = [0] * 4
+        motorSpeed = [0] * 4
+        for motor in self.motors.values():
+            motorEnable[motor.port] = int(motor.enabled())
+            motorSpeed[motor.port] = motor.power()
+        return BrickPiCommands(motorEnable, motorSpeed)
+
+    def beginExchange(self):
+        # Starts exchanging values with the board in its exchange thread.
+        if self.exchangeThread is None:
+            self.exchangeThread = BrickPiExchangeThread(self.driver)
+            self.exchangeThread.start()
+        self.exchangeThread.beginExchange()
+
+    def endExchange(self):
+        self.exchangeThread.endExchange()
+
+    def stopExchangeThread(self):
+        # Stops the exchange thread, if there is one.  The next exchange starts another.
+        if self.exchangeThread is not None:
+            self.exchangeThread.stop()
+            self.exchangeThread = None
+
+    def distributeSamples(self, samples):
+        # Passes the values from a list of BrickPiSamples to the motors and sensors.
+        # Motors on skipped chips weren't read, so their positions are stale.  (Failed exchanges don't count:
+        # without a working board, motors keep the positions they have.)
+        if len(samples) == 1:
+            sample = samples[0]
+            for motor in self.motors.values():
+                if sample.encodersCurrent[motor.port]:
+                    motor.updatePosition( sample.encoders[motor.port], sample.timeMillis )
+                else:
+                    motor.markPositionStale()
+            for sensor in self.sensors.values():
+                sensor.updateValue( sample.sensors[sensor.port] )
+        else:
+            for motor in self.motors.values():
+                readings = [(sample.timeMillis, sample.encoders[motor.port]) for sample in samples if sample.encodersCurrent[motor.port]]
+                if readings:
+                    motor.updatePositions( readings )
+                else:
+                    motor.markPositionStale()
+            for sensor in self.sensors.values():
+                sensor.updateSamples( [sample.sensors[sensor.port] for sample in samples] )
 
 class BrickPiWrapper(Scheduler):
     '''
@@ -15,57 +83,145 @@ class BrickPiWrapper(Scheduler):
         E.g. BrickPiWrapper( {'1': TouchSensor, '2': UltrasonicSensor } )
 
     Motors and sensors are identified by their port names: motors are A to D; sensors 1 to 5.
+
+    To use several BrickPi boards, pass a list of BrickPiDrivers, one for each, as *boards*; the default is just
+    BrickPi.Driver.  The port names for the boards after the first have the board number as a prefix,
+    e.g. motor('2:A') or {'2:1': TouchSensor}.  Each update exchanges values with all the boards at once,
+    using a thread for each board after the first, so it takes little longer than for one board.
+    Each of the BrickPi's two chips handles two motors (A and B, or C and D) and two sensors (1 and 2, or 3 and 4);
+    updates only communicate with a chip if it has a sensor configured, or a motor enabled - and once a second
+    otherwise.  So the positions of disabled motors may be up to a second old (see Motor.positionStale).
+
+    To save power and serial traffic, set *idleTimeMillisBetweenWorkCalls*: while all the motors are disabled and
+    every coroutine is sleeping (e.g. waiting for a sensor change) or has a period at least that long, work calls
+    are made that far apart.  Enabling a motor, or adding a coroutine that runs at every work call, restores the
+    normal rate straight away: the application classes reschedule the pending work call (see workCallsNeeded).
+
+    By default each update communicates with the BrickPi in the Scheduler's thread.  After startIOThread, a
+    separate thread for each board does the communication, and each update just exchanges snapshots with them.
+    Call shutdown to stop all these threads.
     '''
-    def __init__(self, portTypes = {} ):
+    def __init__(self, portTypes = {}, boards = None ):
         Scheduler.__init__(self)
-        self.motors = { 'A': Motor(BP.PORT_A, self), 'B': Motor(BP.PORT_B, self), 'C': Motor(BP.PORT_C, self), 'D': Motor(BP.PORT_D, self) }
-        self.sensors = {  }
-        BP.BrickPiSetup()  # setup the serial port for communication
-
-        for port, sensorType in portTypes.items():
+        #: Time between work calls while idle, or None to always use timeMillisBetweenWorkCalls.
+        self.idleTimeMillisBetweenWorkCalls = None
+        self.timeOfLastUpdate = None
+        #: The BrickPiBoards, in order
+        self.boards = [BrickPiBoard(driver, i + 1) for i, driver in enumerate(boards or [BP.Driver])]
+        self.motors = { }
+        self.sensors = { }
+        for board in self.boards:
+            for port in (BP.PORT_A, BP.PORT_B, BP.PORT_C, BP.PORT_D):
+                motor = Motor(port, self)
+                motor.idChar = board.portName(motor.idChar)
+                board.motors[port] = self.motors[motor.idChar] = motor
+            board.driver.setup()  # setup the serial port for communication
+
+        for portName, sensorType in portTypes.items():
+            board, port = self.boardAndPort(portName)
             if isinstance(sensorType, int):
                 sensor = Sensor(port, sensorType)
             else:
                 sensor = sensorType(port)
-            self.sensors[sensor.idChar] = sensor
-            BP.BrickPi.SensorType[sensor.port] = sensor.type
-        BP.BrickPiSetupSensors()       #Send the properties of sensors to BrickPi
+            sensor.idChar = board.portName(sensor.idChar)
+            board.sensors[sensor.port] = self.sensors[sensor.idChar] = sensor
+        for board in self.boards:
+            brickPi = board.driver.brickPi
+            for port in range(4):
+                sensor = board.sensors.get(port)
+                if sensor:
+                    brickPi.SensorType[port] = sensor.type
+                brickPi.SensorInUse[port] = sensor is not None
+            board.driver.setupSensors()       #Send the properties of sensors to BrickPi
+        self.update() # Reads every chip, so all the motors start from their actual positions.
 
         self.setUpdateCoroutine( self.updaterCoroutine() )
 
+    def isIdle(self):
+        'Answers whether no motors are enabled, and no coroutines need a faster rate than the idle one.'
+        return (not any(motor.enabled() for motor in self.motors.values())
+                and not self.hasFastCoroutines(self.idleTimeMillisBetweenWorkCalls))
+
+    def workCallIntervalMillis(self):
+        # Overrides Scheduler: backs off to the idle rate when there is nothing needing the normal one.
+        if self.idleTimeMillisBetweenWorkCalls is not None and self.isIdle():
+            return self.idleTimeMillisBetweenWorkCalls
+        return self.timeMillisBetweenWorkCalls
+
+    def boardAndPort(self, portName):
+        # Answers the BrickPiBoard and the port on it, for a port name or number with an optional board prefix.
+        if isinstance(portName, str) and ':' in portName:
+            number, portName = portName.split(':', 1)
+            return self.boards[int(number) - 1], portName
+        return self.boards[0], portName
+
     def motor( self, which ):
-        '''Answers the corresponding motor, e.g. motor('A')
+        '''Answers the corresponding motor, e.g. motor('A'), or motor('2:A') for the second board
         '''
-        return self.motors[which]
+        board, port = self.boardAndPort(which)
+        return self.motors[board.portName(port)]
 
     def sensor( self, which ):
-        '''Answers the corresponding sensor, e.g. sensor('1')
+        '''Answers the corresponding sensor, e.g. sensor('1'), or sensor('2:1') for the second board
         '''
-        return self.sensors[which]
+        board, port = self.boardAndPort(which)
+        return self.sensors[board.portName(port)]
+
+    def startIOThread(self, intervalMillis = 10):
+        '''Starts a BrickPiIOThread for each board, to communicate with the BrickPi every *intervalMillis*, so the
+        serial communication doesn't hold up the coroutines.  Motor settings then reach the BrickPi, and new values
+        reach the motors and sensors, at the first exchange after each update.
+
+        An interval shorter than timeMillisBetweenWorkCalls oversamples: each update passes all the readings since
+        the previous one to the motors and sensors (see Motor.recentTPs and Sensor.samples).'''
+        for board in self.boards:
+            board.ioThread = BrickPiIOThread(intervalMillis, driver = board.driver)
+            board.ioThread.setCommands(board.motorCommands())
+            board.ioThread.start()
+
+    def stopIOThread(self):
+        'Stops the BrickPiIOThreads, if any; updates then communicate with the BrickPi directly again.'
+        for board in self.boards:
+            if board.ioThread:
+                board.ioThread.stop()
+                board.ioThread = None
+
+    def shutdown(self):
+        'Stops all the threads communicating with the BrickPi boards: call it when the program has finished with them.'
+        self.stopIOThread()
+        for board in self.boards:
+            board.stopExchangeThread()
 
     def update(self):
-        # Communicates with the BrickPi processor, sending current motor settings, and receiving sensor values.
-        global BrickPi
-        for motor in self.motors.values():
-            BP.BrickPi.MotorEnable[motor.port] = int(motor.enabled())
-            BP.BrickPi.MotorSpeed[motor.port] = motor.power()
-
+        # Communicates with the BrickPi boards, sending current motor settings, and receiving sensor values.
+        direct = [board for board in self.boards if not board.ioThread]
+        for board in direct:
+            board.motorCommands().copyTo(board.driver.brickPi)
         # Updates sensor readings, motor locations, and motor power settings.
-        # Takes about 6ms.
-        BP.BrickPiUpdateValues()
-
-        for motor in self.motors.values():
-            position = BP.BrickPi.Encoder[motor.port]
-            if not isinstance( position, ( int, long ) ):  # For mac
-                position = 0
-            motor.updatePosition( position )
-
-        for sensor in self.sensors.values():
-            value = BP.BrickPi.Sensor[sensor.port]
-            if not isinstance( value, ( int, long ) ):  # For mac
-                value = 0
-            sensor.updateValue( value )
-
+        # Takes about 6ms, for all the boards together.
+        for board in direct[1:]:
+            board.beginExchange()
+        try:
+            if direct:
+                direct[0].driver.updateValues()
+        finally: # The other boards' drivers are only safe to use again once their exchanges have finished.
+            for board in direct[1:]:
+                board.endExchange()
+        # The first update in a work call is timed by the work call; a second one, after the coroutines, is later.
+        timeMillis = self.workCallTimeMillis()
+        if timeMillis == self.timeOfLastUpdate:
+            timeMillis = Scheduler.currentTimeMillis()
+        self.timeOfLastUpdate = timeMillis
+
+        for board in self.boards:
+            if board.ioThread:
+                board.ioThread.setCommands(board.motorCommands())
+                samples = board.ioThread.takeSamples()
+                if not samples: # No new values yet.
+                    continue
+            else:
+                samples = [BrickPiSample.fromBrickPi(timeMillis, board.driver)]
+            board.distributeSamples(samples)
 
     def updaterCoroutine(self):
         # Coroutine to call the update function.
@@ -0,0 +1,59 @@
+# Clock
+# Time sources for the Scheduler and the coroutines.
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+import sys
+import time
+
+CLOCK_MONOTONIC = 1 # Linux value, from <time.h>
+
+def findMonotonicTimeFunction():
+    # Answers a function answering the time in seconds from the system's monotonic clock.
+    # Python 2 doesn't provide one, so on Linux we call clock_gettime directly; elsewhere we fall back to time.time.
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if not sys.platform.startswith('linux'):
+        return time.time
+    try:
+        import ctypes, ctypes.util
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c')).clock_gettime
+        Timespec = ctypes.c_long * 2 # tv_sec, tv_nsec
+        def monotonicTime():
+            timespec = Timespec() # One for each call, since several threads may be reading the clock.
+            clock_gettime(CLOCK_MONOTONIC, timespec)
+            return timespec[0] + timespec[1] * 1e-9
+        if clock_gettime(CLOCK_MONOTONIC, Timespec()) != 0:
+            return time.time
+        return monotonicTime
+    except (ImportError, OSError, AttributeError, TypeError):
+        return time.time
+
+class MonotonicClock():
+    '''Clock answering the time in floating point milliseconds since it was created.
+    It uses the system's monotonic clock where possible, so it isn't affected by changes to the time of day (e.g. NTP).
+    '''
+    #: Function answering the system monotonic time in seconds
+    monotonicTime = staticmethod(findMonotonicTimeFunction())
+
+    def __init__(self):
+        self.startTime = MonotonicClock.monotonicTime()
+
+    def timeMillis(self):
+        'Answers the time in floating point milliseconds since this clock was created.'
+        return (MonotonicClock.monotonicTime() - self.startTime) * 1000.0
+
+class VirtualClock():
+    '''Clock for simulations: its time only changes when advance() is called, so a program using it can run
+    faster than real time.
+    '''
+    def __init__(self, timeMillis = 0.0):
+        self.time = float(timeMillis)
+
+    def timeMillis(self):
+        'Answers the current virtual time in floating point milliseconds.'
+        return self.time
+
+    def advance(self, timeMillis):
+        'Moves the virtual time on by *timeMillis*.'
+        self.time += timeMillis
@@ -5,20 +5,51 @@
 
 
 from BrickPiWrapper import BrickPiWrapper
-import time
+from Scheduler import Scheduler
+from Clock import VirtualClock
+import threading
 
 class CommandLineApplication(BrickPiWrapper):
     '''
     Main application class for command-line only apps.  Doesn't support user input.
+
+    It can also run as a simulation, using virtual time: it then never sleeps, but advances the clock
+    to the time of each work call, so hours of robot behaviour run in seconds.
     '''
 
-    def __init__(self, sensorConfiguration={}):
-        '''Initialization: *sensorConfiguration* is a map as passed to BrickPiWrapper'''
-        BrickPiWrapper.__init__(self, sensorConfiguration )
+    def __init__(self, sensorConfiguration={}, simulation=False, boards=None):
+        '''Initialization: *sensorConfiguration* and *boards* are as passed to BrickPiWrapper.
+        If *simulation* is true, it sets a VirtualClock as the clock for all timing (see Scheduler.setClock).'''
+        #: The VirtualClock if this is a simulation, otherwise None.
+        self.virtualClock = VirtualClock() if simulation else None
+        if simulation:
+            Scheduler.setClock(self.virtualClock)
+        BrickPiWrapper.__init__(self, sensorConfiguration, boards )
+        self.workCallsNeededEvent = threading.Event()
+
+    def waitForNextWorkCall(self):
+        # Private: sleeps until the next work call is due - or for a simulation, moves the clock on to then.
+        # Another thread may bring the work call forward, e.g. by enabling a motor (see workCallsNeeded).
+        if self.virtualClock is None:
+            self.workCallsNeededEvent.clear()
+            self.workCallsNeeded.addListener(self, self.workCallsNeededEvent.set)
+            timeToWait = self.timeMillisToNextCall()
+            while timeToWait > 0 and not self.workCallsNeededEvent.wait(timeToWait / 1000.0):
+                timeToWait = self.timeMillisToNextCall()
+            self.workCallsNeeded.removeListener(self)
+        else:
+            timeToWait = self.timeMillisToNextCall()
+            self.virtualClock.advance(timeToWait if timeToWait > 0 else self.timeMillisBetweenWorkCalls)
+
+    def runFor(self, timeMillis):
+        'Runs the application for *timeMillis* (virtual time in a simulation), then returns.'
+        endTime = Scheduler.currentTimeMillis() + timeMillis
+        while Scheduler.currentTimeMillis() < endTime:
+            self.doWork()
+            self.waitForNextWorkCall()
 
     def mainloop(self):
         'The main loop for the application - call this after initialization.  Never returns.'
         while True:
             self.doWork()
-            time.sleep(self.timeMillisToNextCall() / 1000.0)
-
+            self.waitForNextWorkCall()
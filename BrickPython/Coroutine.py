@@ -6,36 +6,181 @@
 import logging
 import sys, traceback
 import threading
-import datetime
+from Clock import MonotonicClock
 
 class StopCoroutineException( Exception ):
     '''Exception used to stop a coroutine'''
     pass
 
-ProgramStartTime = datetime.datetime.now()
+class Notifier():
+    '''Something that coroutines can wait for, such as a change to a sensor value.
 
-class Coroutine( threading.Thread ):
-    def __init__(self, func, *args, **kwargs):
+    A coroutine waits for it by yielding a Wakeup that includes it; calling notify() wakes all such coroutines.
+    '''
+    def __init__(self):
+        self.listeners = {}
+
+    def addListener(self, key, function):
+        # Registers function to be called (once) at the next notify() call, replacing any previous one with the same key.
+        self.listeners[key] = function
+
+    def removeListener(self, key):
+        # Unregisters the function with the given key, if there is one.
+        self.listeners.pop(key, None)
+
+    def notify(self):
+        'Wakes all the coroutines waiting for this notifier'
+        listeners = self.listeners
+        self.listeners = {}
+        for function in listeners.values():
+            function()
+
+class Wakeup():
+    '''Yielded by a generator coroutine, or passed to Coroutine.wait(), to tell the Scheduler that the coroutine
+    needn't be resumed before time *timeMillis* (None for no time limit), or before one of the Notifiers
+    in *notifiers* has been notified.
+
+    It's only a hint: the coroutine may still be resumed earlier, so it must check its condition again.
+    '''
+    def __init__(self, timeMillis=None, notifiers=()):
+        #: Time (as from currentTimeMillis) at which the coroutine next needs to run, or None
+        self.timeMillis = timeMillis
+        #: Notifiers that should wake the coroutine
+        self.notifiers = list(notifiers)
+
+    def __repr__(self):
+        return "Wakeup (%r, %d notifiers)" % (self.timeMillis, len(self.notifiers))
+
+    @staticmethod
+    def combine(hints):
+        '''Answers the hint for a coroutine running several others that have answered *hints*: a Wakeup due when
+        the first of them is due, or None if any of them needs to run at the next work call.'''
+        if hints == [] or not all(isinstance(h, Wakeup) for h in hints):
+            return None
+        times = [h.timeMillis for h in hints if h.timeMillis is not None]
+        return Wakeup(min(times) if times else None, [n for h in hints for n in h.notifiers])
+
+def logException(logger, e):
+    # Logs an exception caught from a coroutine.  Must be called from within the except clause.
+    logger.info( "Coroutine - caught exception: %r" % (e) )
+    exc_type, exc_value, exc_traceback = sys.exc_info()
+    trace = "".join(traceback.format_tb(exc_traceback))
+    logger.debug( "Traceback (latest call first):\n %s" % trace )
+
+class CoroutineThreadPool():
+    '''The pool of threads that execute Coroutine objects.
+
+    Each new Coroutine takes an idle thread from the pool, starting a new thread only if none is idle, and the thread
+    returns to the pool when the coroutine finishes.  At most *maxIdleThreads* threads wait in the pool; any others
+    terminate.  New threads get *stackSize* bytes of stack: by default (0) the platform's, which allows recursion
+    up to Python's recursion limit.  A smaller stack saves memory with many coroutines, but deep recursion in one
+    then crashes the interpreter rather than raising RuntimeError.
+
+    To configure it, replace Coroutine.threadPool before creating any Coroutines.
+    '''
+    def __init__(self, maxIdleThreads=8, stackSize=0):
+        self.maxIdleThreads = maxIdleThreads
+        self.stackSize = stackSize
+        self.idleThreads = []
+        self.lock = threading.Lock()
+
+    def start(self, coroutine):
+        # Private: executes coroutine.run() in a thread from the pool.
+        with self.lock:
+            thread = self.idleThreads.pop() if self.idleThreads else None
+        if thread is None:
+            thread = self.newThread()
+        thread.execute(coroutine)
+
+    def newThread(self):
+        # Private: answers a new pooled thread with the configured stack size, if the platform supports it.
+        try:
+            previousStackSize = threading.stack_size(self.stackSize)
+        except (ValueError, threading.ThreadError):
+            logging.debug( "CoroutineThreadPool - can't set stack size %d" % self.stackSize )
+            return PooledThread(self)
+        try:
+            return PooledThread(self)
+        finally:
+            threading.stack_size(previousStackSize)
+
+    def threadFinished(self, thread):
+        # Private: called by a thread whose coroutine has finished.  Answers whether it should wait for more work.
+        with self.lock:
+            if len(self.idleThreads) < self.maxIdleThreads:
+                self.idleThreads.append(thread)
+                return True
+            return False
+
+class PooledThread( threading.Thread ):
+    '''Internal: A thread that executes Coroutines for a CoroutineThreadPool.'''
+    def __init__(self, pool):
         threading.Thread.__init__(self)
+        self.pool = pool
+        #: The Coroutine currently being executed
+        self.coroutine = None
+        self.workSemaphore = threading.Semaphore(0)
+        self.setDaemon(True) # Daemon threads don't prevent the process from exiting.
+        self.start()
+
+    def execute(self, coroutine):
+        # Private: Executed from the caller thread.  Starts executing the given coroutine.
+        self.coroutine = coroutine
+        self.workSemaphore.release()
+
+    def run(self):
+        while True:
+            self.workSemaphore.acquire()
+            coroutine = self.coroutine
+            coroutine.run()
+            self.coroutine = None
+            waitForMoreWork = self.pool.threadFinished(self)
+            coroutine.callerSemaphore.release() # Only now can the caller see that it's finished.
+            if not waitForMoreWork:
+                return
+
+class Coroutine():
+    '''A coroutine executing *func* (with the given parameters) in its own thread, taken from Coroutine.threadPool.
+    Each call() runs it until it calls Coroutine.wait().'''
+
+    #: The CoroutineThreadPool supplying the threads for all Coroutines
+    threadPool = CoroutineThreadPool()
+    #: The clock used for all timing: any object with a timeMillis() method.  The default starts at program start.
+    clock = MonotonicClock()
+
+    def __init__(self, func, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
         self.logger = logging
         self.mySemaphore = threading.Semaphore(0)
         self.callerSemaphore = threading.Semaphore(0)
         self.stopEvent = threading.Event()
-        self.setDaemon(True) # Daemon threads don't prevent the process from exiting.
+        self.finishedEvent = threading.Event()
         self.func = func
         self.lastExceptionCaught = None
-        self.start()
+        Coroutine.threadPool.start(self)
+
+    def is_alive(self):
+        'Answers true until the coroutine function has finished'
+        return not self.finishedEvent.is_set()
+
+    isAlive = is_alive
+
+    def isDaemon(self):
+        'Answers true: coroutines, like daemon threads, never prevent the process from exiting'
+        return True
+
+    def join(self, timeout = None):
+        'Waits until the coroutine function has finished'
+        self.finishedEvent.wait(timeout)
 
     @staticmethod
     def currentTimeMillis():
-        'Answers the time in floating point milliseconds since program start.'
-        global ProgramStartTime
-        c = datetime.datetime.now() - ProgramStartTime
-        return c.days * (3600.0 * 1000 * 24) + c.seconds * 1000.0 + c.microseconds / 1000.0
+        'Answers the time in floating point milliseconds since program start, from Coroutine.clock.'
+        return Coroutine.clock.timeMillis()
 
     def run(self):
+        # Private: executed in the pooled thread.
         self.callResult = None
         try:
             self.mySemaphore.acquire()
@@ -44,13 +189,9 @@ class Coroutine( threading.Thread ):
             pass
         except Exception as e:
             self.lastExceptionCaught = e
-            self.logger.info( "Coroutine - caught exception: %r" % (e) )
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            trace = "".join(traceback.format_tb(exc_traceback))
-            self.logger.debug( "Traceback (latest call first):\n %s" % trace )
+            logException(self.logger, e)
         self.stopEvent.set() # Need to tell caller to do a join.
-        self.callerSemaphore.release()
-        threading.Thread.run(self) # Does some cleanup.
+        self.finishedEvent.set()
 
     def call(self, param = None):
         '''Executed from the caller thread.  Runs the coroutine until it calls wait.
@@ -81,7 +222,7 @@ class Coroutine( threading.Thread ):
         '''Called from within the coroutine to hand back control to the caller thread.
         If a parameter is passed, it will be returned from Coroutine.call in the caller thread.
         '''
-        self=threading.currentThread()
+        self=threading.currentThread().coroutine
         self.callResult = param
         self.callerSemaphore.release()
         self.mySemaphore.acquire()
@@ -94,18 +235,21 @@ class Coroutine( threading.Thread ):
         '''Called from within the coroutine to wait the given time.
         I.e. Invocations of the coroutine using call() will do nothing until then. '''
         startTime = Coroutine.currentTimeMillis()
+        wakeup = Wakeup(startTime + timeMillis)
         while Coroutine.currentTimeMillis() - startTime < timeMillis:
-            Coroutine.wait()
+            Coroutine.wait(wakeup)
 
     @staticmethod
     def runTillFirstCompletes(*coroutines):
         def runTillFirstCompletesFunc(*coroutineList):
             while all(c.is_alive() for c in coroutineList):
+                hints = []
                 for c in coroutineList:
-                    c.call()
+                    hints.append(c.call())
                     if not c.is_alive():
+                        hints.append(None) # Finished, so we must finish too without waiting.
                         break
-                Coroutine.wait()
+                Coroutine.wait(Wakeup.combine(hints))
             for c in coroutineList:
                 if c.is_alive():
                     c.stop()
@@ -117,9 +261,8 @@ class Coroutine( threading.Thread ):
     def runTillAllComplete(*coroutines):
         def runTillAllCompleteFunc(*coroutineList):
             while any(c.is_alive() for c in coroutineList):
-                for c in coroutineList:
-                    c.call()
-                Coroutine.wait()
+                hints = [c.call() for c in coroutineList if c.is_alive()]
+                Coroutine.wait(Wakeup.combine(hints))
 
         result = Coroutine(runTillAllCompleteFunc, *coroutines)
         return result
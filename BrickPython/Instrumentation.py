@@ -0,0 +1,169 @@
+# Instrumentation
+# Timing statistics for the Scheduler and its coroutines.
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from Clock import MonotonicClock
+
+class Histogram():
+    '''Histogram of times in milliseconds, using a fixed set of buckets so its memory use never grows.
+
+    Bucket i counts the times no greater than *bucketLimits*[i] (and greater than the previous limit);
+    the last bucket counts anything larger.
+    '''
+    #: Default bucket limits, in milliseconds
+    DEFAULT_LIMITS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, bucketLimits = DEFAULT_LIMITS):
+        self.bucketLimits = bucketLimits
+        self.buckets = [0] * (len(bucketLimits) + 1)
+        #: Number of times added
+        self.count = 0
+        #: Sum of all the times added
+        self.total = 0.0
+        #: Largest time added
+        self.max = 0.0
+
+    def add(self, timeMillis):
+        'Adds one time measurement'
+        i = 0
+        for limit in self.bucketLimits:
+            if timeMillis <= limit:
+                break
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += timeMillis
+        if timeMillis > self.max:
+            self.max = timeMillis
+
+    def mean(self):
+        'Answers the mean of the times added'
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        '''Answers an upper bound for the given percentile of the times added: the limit of the bucket containing it
+        (or the maximum, for the last bucket).'''
+        required = self.count * percent / 100.0
+        soFar = 0
+        for i, n in enumerate(self.buckets):
+            soFar += n
+            if soFar >= required and n > 0:
+                return self.bucketLimits[i] if i < len(self.bucketLimits) else self.max
+        return self.max
+
+    def __repr__(self):
+        return "count=%d mean=%.3f p90<=%.3f max=%.3f" % (self.count, self.mean(), self.percentile(90), self.max)
+
+class CoroutineStats():
+    'Timings for one coroutine.  Times are in milliseconds.'
+    def __init__(self, name):
+        #: Identifies the coroutine in reports
+        self.name = name
+        #: Number of times invoked
+        self.resumeCount = 0
+        #: Total execution time
+        self.totalMillis = 0.0
+        #: Longest single execution time
+        self.maxMillis = 0.0
+        #: Time (from the instrumentation timer) of the latest invocation
+        self.lastResumeTime = None
+
+    def add(self, startTime, endTime):
+        'Records one invocation'
+        elapsed = endTime - startTime
+        self.resumeCount += 1
+        self.totalMillis += elapsed
+        if elapsed > self.maxMillis:
+            self.maxMillis = elapsed
+        self.lastResumeTime = startTime
+
+    def __repr__(self):
+        return "%s: resumes=%d total=%.3f max=%.3f" % (self.name, self.resumeCount, self.totalMillis, self.maxMillis)
+
+class SchedulerStats():
+    '''Timing statistics for a Scheduler, collected when its instrumentation is started.
+
+    The times are measured using real time, even when the Scheduler uses a virtual clock.
+    '''
+    #: Timer used for all measurements
+    timer = MonotonicClock()
+
+    def __init__(self, timeMillisBetweenWorkCalls):
+        self.timeMillisBetweenWorkCalls = timeMillisBetweenWorkCalls
+        #: Duration of each work call
+        self.workCallTimes = Histogram()
+        #: Time between the start of successive work calls
+        self.intervals = Histogram()
+        #: Duration of each invocation of the update coroutine (the BrickPi serial communication)
+        self.updateTimes = Histogram()
+        #: Number of work calls taking longer than timeMillisBetweenWorkCalls
+        self.overruns = 0
+        #: Number of coroutine invocations later than their deadlines
+        self.deadlinesMissed = 0
+        #: Stats for each running coroutine, by the generator or Coroutine added
+        self.coroutines = {}
+        #: Stats for finished coroutines, combined by name
+        self.finishedCoroutines = {}
+        self.lastWorkCallStart = None
+
+    @staticmethod
+    def timeMillis():
+        'Answers the current time from the instrumentation timer'
+        return SchedulerStats.timer.timeMillis()
+
+    def workCallStarted(self, startTime):
+        if self.lastWorkCallStart is not None:
+            self.intervals.add(startTime - self.lastWorkCallStart)
+        self.lastWorkCallStart = startTime
+
+    def workCallFinished(self, startTime, endTime):
+        self.workCallTimes.add(endTime - startTime)
+        if endTime - startTime > self.timeMillisBetweenWorkCalls:
+            self.overruns += 1
+
+    def updateFinished(self, startTime, endTime):
+        self.updateTimes.add(endTime - startTime)
+
+    @staticmethod
+    def coroutineName(key):
+        # Answers the name identifying a coroutine in reports: its function's name, so the stats for
+        # all the coroutines from one function combine.
+        function = getattr(key, 'func', key) # A Coroutine runs its func; a generator has the function's name.
+        return getattr(function, '__name__', key.__class__.__name__)
+
+    def coroutineResumed(self, key, startTime, endTime):
+        stats = self.coroutines.get(key)
+        if stats is None:
+            stats = self.coroutines[key] = CoroutineStats(SchedulerStats.coroutineName(key))
+        stats.add(startTime, endTime)
+
+    def coroutineFinished(self, key):
+        # Moves the stats for a finished coroutine into the combined stats for coroutines of that name.
+        stats = self.coroutines.pop(key, None)
+        if stats is None:
+            return
+        combined = self.finishedCoroutines.get(stats.name)
+        if combined is None:
+            combined = self.finishedCoroutines[stats.name] = CoroutineStats(stats.name)
+        combined.resumeCount += stats.resumeCount
+        combined.totalMillis += stats.totalMillis
+        combined.maxMillis = max(combined.maxMillis, stats.maxMillis)
+        combined.lastResumeTime = stats.lastResumeTime
+
+    def coroutineStats(self, coroutine):
+        'Answers the CoroutineStats for the given running generator or Coroutine, or None'
+        return self.coroutines.get(coroutine)
+
+    def report(self):
+        'Answers a multi-line text summary of all the statistics, most time-consuming coroutines first'
+        lines = ["Work calls: %r" % self.workCallTimes,
+                 "Overruns: %d" % self.overruns,
+                 "Missed deadlines: %d" % self.deadlinesMissed,
+                 "Intervals: %r" % self.intervals,
+                 "Updates: %r" % self.updateTimes,
+                 "Running coroutines:"]
+        lines += ["  %r" % c for c in sorted(self.coroutines.values(), key=lambda c: -c.totalMillis)]
+        lines.append("Finished coroutines:")
+        lines += ["  %r" % c for c in sorted(self.finishedCoroutines.values(), key=lambda c: -c.totalMillis)]
+        return "\n".join(lines)
@@ -48,6 +48,18 @@ class TimePosition():
             result = 1000.0 * (self.position - other.position) / (self.time - other.time)
         return result
 
+    @staticmethod
+    def fittedSpeed(timePositions):
+        'Answers the speed in clicks per second of the least squares straight line through the given TimePositions'
+        n = len(timePositions)
+        meanTime = sum(tp.time for tp in timePositions) / n
+        meanPosition = sum(tp.position for tp in timePositions) / float(n)
+        variance = sum((tp.time - meanTime) ** 2 for tp in timePositions)
+        if variance == 0:
+            return 0.0
+        covariance = sum((tp.time - meanTime) * (tp.position - meanPosition) for tp in timePositions)
+        return 1000.0 * covariance / variance
+
 class Motor():
     '''An NXT motor connected to a BrickPi port.
 
@@ -70,8 +82,12 @@ class Motor():
         self._power = 0
         self.pidSetting = PIDSetting()
         self.currentTP = self.previousTP = TimePosition(0, self.timeMillis())
+        #: The TimePositions received in the latest update: more than one if the BrickPi is oversampled.
+        self.recentTPs = [self.currentTP]
         self.scheduler = scheduler
         self.basePosition = 0
+        #: True if the latest update didn't read the position, since it skipped the motor's BrickPi chip as unused.
+        self.positionStale = False
 
     def setPIDSetting( self, pidSetting ):
         'Sets the parameters for the PID servo motor algorithm'
@@ -90,23 +106,46 @@ class Motor():
         return self._enabled
     def enable(self, whether):
         'Sets whether the motor is enabled'
+        wasEnabled = self._enabled
         self._enabled = whether
+        if whether and not wasEnabled and self.scheduler:
+            self.scheduler.workCallsNeeded.notify() # The work calls may need to speed up from the idle rate.
 
     def zeroPosition(self):
         'Resets the motor base for its position to the current position.'
         self.basePosition += self.position()
 
     def speed(self):
-        'Answers the current speed calculated from the latest two position readings'
-        return self.currentTP.averageSpeedFrom( self.previousTP )
+        '''Answers the current speed calculated from the position readings in the latest update and the one before:
+        usually just two readings, but more if the BrickPi is oversampled.'''
+        if len(self.recentTPs) == 1:
+            return self.currentTP.averageSpeedFrom( self.previousTP )
+        return TimePosition.fittedSpeed( [self.previousTP] + self.recentTPs )
 
     def __repr__(self):
         return "Motor %s (location=%d, speed=%f)" % (self.idChar, self.position(), self.speed())
 
-    def updatePosition(self, newPosition):
-        # Called by the framework when the BrickPi provides a new motor position.
+    def updatePosition(self, newPosition, timeMillis = None):
+        # Called by the framework when the BrickPi provides a new motor position,
+        # usually with the time it was read (shared by all the motors, so we don't read the clock for each).
+        if timeMillis is None:
+            timeMillis = self.timeMillis()
+        self.previousTP = self.currentTP
+        self.currentTP = TimePosition( timeMillis, newPosition - self.basePosition )
+        self.recentTPs = [self.currentTP]
+        self.positionStale = False
+
+    def markPositionStale(self):
+        # Called by the framework when an update skipped the motor's chip, so didn't read its position.
+        self.positionStale = True
+
+    def updatePositions(self, timesAndPositions):
+        # Called by the framework when the BrickPi has been oversampled, with a list of (time, position) readings
+        # since the last update, oldest first.  The readings are in recentTPs until the next update.
         self.previousTP = self.currentTP
-        self.currentTP = TimePosition( self.timeMillis(), newPosition - self.basePosition )
+        self.recentTPs = [TimePosition( t, position - self.basePosition ) for t, position in timesAndPositions]
+        self.currentTP = self.recentTPs[-1]
+        self.positionStale = False
 
     def stopAndDisable(self):
         'Stops and disables the motor'
@@ -115,19 +154,26 @@ class Motor():
         logging.info("Motor %s stopped" % (self.idChar))
 
     def moveTo( self, *args, **kwargs ):
-        'Alternative name for coroutine positionUsingPIDAlgorithm'
+        '''Alternative name for coroutine positionUsingPIDAlgorithm.
+
+        Like the other motor coroutines, it's critical: however it's added to the scheduler, it runs straight after
+        each update.  Iterated inside another coroutine, it runs at that coroutine's priority.'''
         return self.positionUsingPIDAlgorithm( *args, **kwargs )
 
+    @Scheduler.critical
     def positionUsingPIDAlgorithm( self, target, timeoutMillis = 3000 ):
         'Coroutine to move the motor to position *target*, stopping after *timeoutMillis* if it hasnt reached it yet'
         return self.scheduler.withTimeout( timeoutMillis, self.positionUsingPIDAlgorithmWithoutTimeout( target ) )
 
+    @Scheduler.critical
     def positionUsingPIDAlgorithmWithoutTimeout( self, target ):
         'Coroutine to move the motor to position *target*, using the PID algorithm with the current PIDSettings'
         distanceIntegratedOverTime = 0 # I bit of PID.
         self.enable(True)
         logging.info( "Motor %s moving to %d" % (self.idChar, target) )
         try:
+            while self.positionStale: # Enabling the motor makes the next update read it.
+                yield
             while True:
                 delta = (target - self.currentTP.position)
                 distanceIntegratedOverTime += delta * (self.currentTP.time - self.previousTP.time)
@@ -147,10 +193,12 @@ class Motor():
             self.stopAndDisable()
 
 
+    @Scheduler.critical
     def setSpeed( self, targetSpeedInClicksPerSecond, timeoutMillis = 3000 ):
         'Coroutine to run the motor at constant speed *targetSpeedInClicksPerSecond* for time *timeoutMillis*'
         return self.scheduler.withTimeout( timeoutMillis, self.runAtConstantSpeed( targetSpeedInClicksPerSecond ) )
 
+    @Scheduler.critical
     def runAtConstantSpeed( self, targetSpeedInClicksPerSecond ):
         '''Coroutine to run the motor at constant speed *targetSpeedInClicksPerSecond*
         '''
@@ -3,56 +3,198 @@
 #
 # Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
 
-import threading
-from Coroutine import Coroutine, StopCoroutineException
-
-class GeneratorCoroutineWrapper(Coroutine):
-    '''Internal: Wraps a generator-style coroutine with a thread'''
+import logging
+import heapq
+import itertools
+import atexit
+import weakref
+import functools
+from Coroutine import Coroutine, StopCoroutineException, Wakeup, Notifier, logException
+from Instrumentation import SchedulerStats
+
+#: Schedulers whose timings are logged when the program exits: see Scheduler.startInstrumentation
+schedulersLoggingOnExit = weakref.WeakSet()
+exitHandlerRegistered = False
+
+def logTimingsOnExit():
+    # Logs the timing reports for schedulersLoggingOnExit.  Registered with atexit just once.
+    for scheduler in schedulersLoggingOnExit:
+        if scheduler.stats:
+            logging.info("Scheduler timings:\n" + scheduler.stats.report())
+
+class GeneratorCoroutineWrapper():
+    '''Internal: Runs a generator-style coroutine directly in the scheduler's thread.
+
+    It supports the same interface as Coroutine - call(), stop(), is_alive() - but advances the generator
+    using next() and throw() rather than handing control to and from a separate thread.'''
 
     def __init__(self, generator):
-        '''`scheduler` - the main Scheduler object
-        `generator` - the generator object created by calling the generator function'''
-        Coroutine.__init__(self, self.action)
+        '''`generator` - the generator object created by calling the generator function'''
         self.generator = generator
-
-    def action(self):
-        'The thread entry function - executed within thread `thread`'
-        for _ in self.generator:
-            Coroutine.wait()
+        self.logger = logging
+        self.lastExceptionCaught = None
+        self.alive = True
+
+    def is_alive(self):
+        'Answers whether the generator has yet to finish'
+        return self.alive
+
+    def call(self):
+        '''Runs the generator until its next yield, answering the value yielded.
+        Does nothing if the generator has finished.'''
+        if not self.alive:
+            return None
+        try:
+            return self.generator.next()
+        except (StopCoroutineException, StopIteration):
+            self.alive = False
+        except Exception as e:
+            self.alive = False
+            self.lastExceptionCaught = e
+            logException(self.logger, e)
+            # For testing - assertions within coroutines must be passed back to the caller.
+            if isinstance(e, AssertionError):
+                raise
+        return None
 
     def stop(self):
+        '''Stops the generator by raising StopCoroutineException within it, so any finally clauses get executed.
+        To support this, a coroutine mustn't catch the StopCoroutineException (unless it re-raises it).'''
+        if not self.alive:
+            return
+        self.alive = False
         try:
             self.generator.throw(StopCoroutineException())
-        except StopCoroutineException:
-            pass
-        Coroutine.stop(self)
+        except (StopCoroutineException, StopIteration):
+            return
+        self.generator.close() # It caught the exception and yielded again - be more forceful.
+
+
+class ScheduledCoroutine():
+    '''Internal: The Scheduler's record of one of the coroutines it is running.'''
+
+    def __init__(self, key, coroutine, priority, deadlineMillis, runOrder, periodMillis = None):
+        #: The generator or Coroutine the user added, which identifies the coroutine to the Scheduler
+        self.key = key
+        #: The object to invoke: the Coroutine, or a GeneratorCoroutineWrapper
+        self.coroutine = coroutine
+        #: One of the Scheduler PRIORITY values
+        self.priority = priority
+        #: Time in ms after the start of a work call by which it should be invoked, or None.
+        self.deadlineMillis = deadlineMillis
+        #: Sort key giving the running order: by priority, then deadline, then the order added.
+        #: (Sensor coroutines have negative runOrders, so the latest added comes first.)
+        self.sortKey = (priority, float('inf') if deadlineMillis is None else deadlineMillis, runOrder)
+        #: Time in ms between its invocations, or None to invoke it at every work call.
+        self.periodMillis = periodMillis
+        #: Time when it's next due, if it has a period; None until its first invocation.
+        self.nextDueMillis = None
+        #: True if it's runnable because it has no period, so it waits for the next regular work call.
+        self.waitingForRegularCall = False
+        #: Identifies its current sleep; None when it's runnable.
+        self.sleepId = None
+        #: True if its current sleep has an entry in the Scheduler's heap of sleeping coroutines
+        self.inSleepHeap = False
+        #: The Notifiers it's listening to in its current sleep
+        self.sleepNotifiers = ()
+        #: True once it has been removed from the Scheduler
+        self.finished = False
 
 
 class Scheduler():
     ''' This manages an arbitrary number of coroutines (including generator functions), supporting
     invoking each every *timeMillisBetweenWorkCalls*, and detecting when each has completed.
 
-    It supports one special coroutine - the updatorCoroutine, which is invoked before and after all the other ones.
+    It supports one special coroutine - the updatorCoroutine, which is invoked before and after all the other ones
+    (or only before them, if *singleUpdatePerWorkCall* is set).
+
+    Generator coroutines are executed directly in the calling thread; only Coroutine objects use threads.
+
+    A coroutine that yields a Wakeup (or passes one to Coroutine.wait) is put to sleep: it isn't invoked again until
+    the work call at or after the Wakeup time, or after one of the Wakeup's Notifiers is notified.
+    So sleeping coroutines cost nothing per work call.
+
+    Each work call invokes the coroutines in order of priority: see addCoroutine.
+    A coroutine may also have its own period, to be invoked more or less often than every work call.
+    The scheduler makes extra work calls between the regular ones when a sleeping coroutine or one with a shorter
+    period is due; coroutines without a period are only invoked at the regular work calls.
+
+    Coroutines are identified by the generator or Coroutine object added; adding, stopping and finding one takes
+    constant time however many there are.
     '''
 
     timeMillisBetweenWorkCalls = 50
 
+    #: Coroutine priorities: in each work call, coroutines with a lower value run earlier.
+    #: Critical ones, such as motor control loops, run first after the update coroutine.
+    PRIORITY_CRITICAL = 0
+    #: Priority for addSensorCoroutine
+    PRIORITY_SENSOR = 10
+    #: Priority for addActionCoroutine
+    PRIORITY_ACTION = 20
+    #: Coroutines with this priority value or above, such as logging and display, run last and are skipped
+    #: if the work call has used up its time budget.
+    PRIORITY_BACKGROUND = 30
+
+    #: The generators and Coroutines answered by functions decorated with Scheduler.critical
+    criticalCoroutines = weakref.WeakSet()
+
     @staticmethod
-    def makeCoroutine(coroutineOrGenerator):
-        return coroutineOrGenerator if coroutineOrGenerator is Coroutine else GeneratorCoroutineWrapper(coroutineOrGenerator)
+    def critical(function):
+        '''Decorator for functions answering coroutines that must run first in each work call, such as motor
+        control loops: the coroutines are scheduled at PRIORITY_CRITICAL unless added with an explicit priority.'''
+        @functools.wraps(function)
+        def criticalFunction(*args, **kwargs):
+            coroutine = function(*args, **kwargs)
+            Scheduler.criticalCoroutines.add(coroutine)
+            return coroutine
+        return criticalFunction
 
+    @staticmethod
+    def defaultPriority(coroutine, priority):
+        # Private: answers the priority for a coroutine added without an explicit one.
+        return Scheduler.PRIORITY_CRITICAL if coroutine in Scheduler.criticalCoroutines else priority
+
+    @staticmethod
+    def makeCoroutine(coroutineOrGenerator):
+        # Answers an object supporting call(), stop() and is_alive() for the given Coroutine or generator.
+        return coroutineOrGenerator if isinstance(coroutineOrGenerator, Coroutine) else GeneratorCoroutineWrapper(coroutineOrGenerator)
 
     @staticmethod
     def currentTimeMillis():
+        'Answers the time in floating point milliseconds since program start.'
         return Coroutine.currentTimeMillis()
 
+    @staticmethod
+    def setClock(clock):
+        '''Sets the clock used for all timing by schedulers, coroutines and motors: any object with a timeMillis() method
+        answering floating point milliseconds, such as a Clock.MonotonicClock.'''
+        Coroutine.clock = clock
+
     def __init__(self, timeMillisBetweenWorkCalls = 50):
         Scheduler.timeMillisBetweenWorkCalls = timeMillisBetweenWorkCalls
-        self.coroutines = []
-        self.timeOfLastCall = Scheduler.currentTimeMillis()
+        self.coroutines = {}   # generator or Coroutine -> its ScheduledCoroutine.
+        self.runnable = []     # ScheduledCoroutines to invoke at the next work call.
+        self.runnableNeedsSorting = False
+        self.sleeping = []     # Heap of (wakeup time, sleep id, ScheduledCoroutine) - may contain stale entries.
+        self.staleSleepers = 0 # Number of stale entries in the heap: it's compacted when they dominate.
+        self.sleepSequence = itertools.count()
+        self.nextRunOrder = 1
+        self.timeOfLastCall = self.timeOfLastRegularCall = Scheduler.currentTimeMillis()
+        #: Background coroutines are skipped once a work call has taken this long; None means timeMillisBetweenWorkCalls.
+        self.workCallBudgetMillis = None
         self.updateCoroutine = Scheduler.makeCoroutine( self.nullCoroutine() ) # for testing - usually replaced.
+        #: If True, the update coroutine is only invoked at the start of each work call, so each BrickPi exchange
+        #: sends the motor settings from the previous work call and reads the sensors for this one.
+        #: That halves the serial traffic, at the cost of motor commands taking effect one work call later.
+        self.singleUpdatePerWorkCall = False
         #: The most recent exception raised by a coroutine:
         self.lastExceptionCaught = Exception("None")
+        #: Timing statistics, or None if instrumentation hasn't been started.  See startInstrumentation.
+        self.stats = None
+        #: Notified when a work call may be needed sooner than timeMillisToNextCall said: when a coroutine is added,
+        #: or a motor enabled.  Application loops waiting for the next work call listen to it, to wait less.
+        self.workCallsNeeded = Notifier()
 
     def doWork(self):
         'Executes all the coroutines, handling exceptions'
@@ -61,54 +203,279 @@ class Scheduler():
         if timeNow == self.timeOfLastCall: # Ensure each call gets a different timer value.
             return
         self.timeOfLastCall = timeNow
-        self.updateCoroutine.call()
-        for coroutine in self.coroutines[:]:   # Copy of coroutines, so it doesn't matter removing one
-            coroutine.call()
+        # An extra call is one made early for sleeping coroutines now due; the others wait for a regular one.
+        nextWakeupTime = self.nextWakeupTime()
+        regularCall = (timeNow - self.timeOfLastRegularCall >= self.workCallIntervalMillis()
+                       or nextWakeupTime is None or nextWakeupTime > timeNow)
+        if regularCall:
+            self.timeOfLastRegularCall = timeNow
+        stats = self.stats
+        if stats:
+            startTime = stats.timeMillis()
+            stats.workCallStarted(startTime)
+        self.callUpdateCoroutine()
+        self.wakeSleepingCoroutines(timeNow)
+        if self.runnableNeedsSorting:
+            self.runnable.sort(key=lambda record: record.sortKey)
+            self.runnableNeedsSorting = False
+        running = self.runnable
+        self.runnable = []
+        budgetExhausted = False
+        for record in running:
+            if record.finished: # Stopped since it was last invoked.
+                continue
+            if record.waitingForRegularCall and not regularCall:
+                self.runnable.append(record)
+                continue
+            if record.priority >= Scheduler.PRIORITY_BACKGROUND:
+                budgetExhausted = budgetExhausted or self.workCallBudgetExhausted(timeNow)
+                if budgetExhausted: # Leave it for the next work call.
+                    self.runnable.append(record)
+                    self.runnableNeedsSorting = True
+                    continue
+            if record.deadlineMillis is not None:
+                self.checkDeadline(record, timeNow)
+            coroutine = record.coroutine
+            if stats:
+                resumeTime = stats.timeMillis()
+                hint = coroutine.call()
+                stats.coroutineResumed(record.key, resumeTime, stats.timeMillis())
+            else:
+                hint = coroutine.call()
             if not coroutine.is_alive():
-                self.coroutines.remove(coroutine)
+                self.removeCoroutine(record)
                 self.lastExceptionCaught = coroutine.lastExceptionCaught
-
-        self.updateCoroutine.call()
+            elif isinstance(hint, Wakeup) and (hint.timeMillis is None or hint.timeMillis > timeNow):
+                self.sleepUntil(record, hint)
+            elif record.periodMillis is not None:
+                self.sleepUntilNextPeriod(record, timeNow)
+            else:
+                record.waitingForRegularCall = True
+                self.runnable.append(record)
+
+        if not self.singleUpdatePerWorkCall:
+            self.callUpdateCoroutine()
+        if stats:
+            stats.workCallFinished(startTime, stats.timeMillis())
+
+    def workCallTimeMillis(self):
+        '''Answers the time of the current (or latest) work call, read from the clock once at its start.
+        Within a work call, use it rather than reading the clock again.'''
+        return self.timeOfLastCall
+
+    def callUpdateCoroutine(self):
+        # Private: invokes the update coroutine, timing it if instrumentation is on.
+        if self.stats:
+            startTime = self.stats.timeMillis()
+            self.updateCoroutine.call()
+            self.stats.updateFinished(startTime, self.stats.timeMillis())
+        else:
+            self.updateCoroutine.call()
+
+    def checkDeadline(self, record, timeOfCall):
+        # Private: logs, and counts, the coroutine's invocation if it's later than its deadline.
+        lateMillis = Scheduler.currentTimeMillis() - timeOfCall - record.deadlineMillis
+        if lateMillis > 0:
+            logging.warning("Coroutine %s missed its deadline by %.1fms" % (getattr(record.key, '__name__', record.key), lateMillis))
+            if self.stats:
+                self.stats.deadlinesMissed += 1
 
     def timeMillisToNextCall(self):
-        'Wait time before the next doWork call should be called.'
-        timeRequired = self.timeMillisBetweenWorkCalls + self.timeOfLastCall - Scheduler.currentTimeMillis()
+        'Wait time before the next doWork call should be called: no later than the first sleeping coroutine is due.'
+        nextCallTime = self.workCallIntervalMillis() + self.timeOfLastRegularCall
+        nextWakeupTime = self.nextWakeupTime()
+        if nextWakeupTime is not None:
+            nextCallTime = min(nextCallTime, nextWakeupTime)
+        timeRequired = nextCallTime - Scheduler.currentTimeMillis()
         return max( timeRequired, 0 )
 
 
+    def startInstrumentation(self, logOnExit = False):
+        '''Starts recording timings of the work calls, the update coroutine and each coroutine, answering the
+        Instrumentation.SchedulerStats holding them.  Query it at any time, e.g. print scheduler.stats.report().
+        If *logOnExit* is true, the report is logged (once) when the program exits.'''
+        global exitHandlerRegistered
+        self.stats = SchedulerStats(self.timeMillisBetweenWorkCalls)
+        if logOnExit:
+            schedulersLoggingOnExit.add(self)
+            if not exitHandlerRegistered:
+                atexit.register(logTimingsOnExit)
+                exitHandlerRegistered = True
+        else:
+            schedulersLoggingOnExit.discard(self)
+        return self.stats
+
+    def stopInstrumentation(self):
+        'Stops recording timings.'
+        self.stats = None
+
+    def workCallIntervalMillis(self):
+        '''Answers the time between regular work calls.  Subclasses may vary it; coroutines sleeping or with periods
+        still get work calls when they are due.'''
+        return self.timeMillisBetweenWorkCalls
+
+    def hasFastCoroutines(self, periodMillis):
+        '''Answers whether any runnable coroutine needs invoking more often than every *periodMillis*: that is,
+        one without a period, or with a shorter one.  Sleeping coroutines don't count.'''
+        return any(not record.finished and (record.periodMillis is None or record.periodMillis < periodMillis)
+                   for record in self.runnable)
+
+    def workCallBudgetExhausted(self, timeOfCall):
+        # Private: answers whether the work call that started at timeOfCall has used up its time budget.
+        budget = self.timeMillisBetweenWorkCalls if self.workCallBudgetMillis is None else self.workCallBudgetMillis
+        return Scheduler.currentTimeMillis() - timeOfCall >= budget
+
     def addSensorCoroutine(self, *coroutineList):
         '''Adds one or more new sensor/program coroutines to be scheduled, answering the last one to be added.
-        Sensor coroutines are scheduled *before* Action coroutines'''
+        Sensor coroutines are scheduled *before* Action coroutines (but after critical ones: see Scheduler.critical)'''
         for generatorFunction in coroutineList:
-            latestAdded = Scheduler.makeCoroutine(generatorFunction)
-            self.coroutines.insert(0, latestAdded)
+            self.registerCoroutine(generatorFunction, Scheduler.defaultPriority(generatorFunction, Scheduler.PRIORITY_SENSOR),
+                                   None, -self.nextRunOrder)
         return generatorFunction
 
     def addActionCoroutine(self, *coroutineList):
         '''Adds one or more new motor control coroutines to be scheduled, answering the last coroutine to be added.
-        Action coroutines are scheduled *after* Sensor coroutines'''
+        Action coroutines are scheduled *after* Sensor coroutines, at PRIORITY_ACTION - except for motor control
+        loops such as Motor.moveTo, which are critical (see Scheduler.critical) and run first.'''
         for generatorFunction in coroutineList:
-            latestAdded = Scheduler.makeCoroutine(generatorFunction)
-            self.coroutines.append(latestAdded)
+            self.registerCoroutine(generatorFunction, Scheduler.defaultPriority(generatorFunction, Scheduler.PRIORITY_ACTION),
+                                   None, self.nextRunOrder)
         return generatorFunction
 
+    def addCoroutine(self, coroutine, priority = None, deadlineMillis = None, periodMillis = None):
+        '''Adds a new coroutine to be scheduled with the given priority (one of the PRIORITY values), answering it.
+        The default priority is PRIORITY_ACTION, or PRIORITY_CRITICAL for motor control loops (see Scheduler.critical).
+        Within each work call, coroutines run in order of priority; those with the same priority run in order of
+        *deadlineMillis* - the time after the start of the work call by which each should run - and then
+        in the order they were added.  A coroutine invoked after its deadline is logged as a warning, and counted
+        in the instrumentation's deadlinesMissed.
+
+        If *periodMillis* is given, the coroutine is invoked every *periodMillis* rather than at every work call;
+        the scheduler makes extra work calls for periods shorter than the work call interval, and only the coroutines
+        due then are invoked in them.
+        E.g. addCoroutine( motor.moveTo(100), Scheduler.PRIORITY_CRITICAL, periodMillis=10 )
+        or addCoroutine( logPositions(), Scheduler.PRIORITY_BACKGROUND, periodMillis=500 )'''
+        if priority is None:
+            priority = Scheduler.defaultPriority(coroutine, Scheduler.PRIORITY_ACTION)
+        self.registerCoroutine(coroutine, priority, deadlineMillis, self.nextRunOrder, periodMillis)
+        return coroutine
+
+    def registerCoroutine(self, coroutineOrGenerator, priority, deadlineMillis, runOrder, periodMillis = None):
+        # Private: registers a new coroutine to run at the given position in the running order.
+        # Adding one that's already running does nothing.
+        if coroutineOrGenerator in self.coroutines:
+            return
+        self.nextRunOrder += 1
+        record = ScheduledCoroutine(coroutineOrGenerator, Scheduler.makeCoroutine(coroutineOrGenerator),
+                                    priority, deadlineMillis, runOrder, periodMillis)
+        self.coroutines[coroutineOrGenerator] = record
+        self.runnable.append(record)
+        self.runnableNeedsSorting = True
+        self.workCallsNeeded.notify()
+
+    def removeCoroutine(self, record):
+        # Private: forgets a coroutine that has finished.  It may still be in the runnable list or heap.
+        record.finished = True
+        self.cancelSleep(record)
+        del self.coroutines[record.key]
+        if self.stats:
+            self.stats.coroutineFinished(record.key)
+
+    def sleepUntil(self, record, wakeup):
+        # Private: parks the coroutine until the first work call at or after the wakeup time, or until
+        # one of the wakeup's notifiers is notified.
+        sleepId = record.sleepId = self.sleepSequence.next()
+        if wakeup.timeMillis is not None:
+            heapq.heappush(self.sleeping, (wakeup.timeMillis, sleepId, record))
+            record.inSleepHeap = True
+        record.sleepNotifiers = wakeup.notifiers
+        for notifier in wakeup.notifiers:
+            notifier.addListener(record, lambda: self.wakeFromSleep(record, sleepId))
+
+    @staticmethod
+    def stopListening(record):
+        # Private: removes the coroutine's listeners from the notifiers of its sleep, so they don't accumulate
+        # when it's woken some other way.
+        for notifier in record.sleepNotifiers:
+            notifier.removeListener(record)
+        record.sleepNotifiers = ()
+
+    def sleepUntilNextPeriod(self, record, timeNow):
+        # Private: parks a coroutine with a period until it's next due.  Periods are measured from its first
+        # invocation, so they don't drift; if it has fallen a whole period behind, it skips the missed invocations.
+        if record.nextDueMillis is None or record.nextDueMillis + record.periodMillis <= timeNow:
+            record.nextDueMillis = timeNow + record.periodMillis
+        else:
+            record.nextDueMillis += record.periodMillis
+        sleepId = record.sleepId = self.sleepSequence.next()
+        heapq.heappush(self.sleeping, (record.nextDueMillis, sleepId, record))
+        record.inSleepHeap = True
+
+    def wakeFromSleep(self, record, sleepId):
+        # Private: makes the coroutine runnable again, provided it's still in the given sleep.
+        if record.sleepId == sleepId:
+            self.cancelSleep(record)
+            record.waitingForRegularCall = False
+            self.runnable.append(record)
+            self.runnableNeedsSorting = True
+
+    def cancelSleep(self, record):
+        # Private: ends the coroutine's current sleep, if any.  Its heap entry, if any, becomes stale; once most
+        # entries are stale, the heap is rebuilt without them.
+        record.sleepId = None
+        Scheduler.stopListening(record)
+        if record.inSleepHeap:
+            record.inSleepHeap = False
+            self.staleSleepers += 1
+            if self.staleSleepers > 16 and self.staleSleepers * 2 > len(self.sleeping):
+                self.sleeping = [entry for entry in self.sleeping if entry[2].sleepId == entry[1]]
+                heapq.heapify(self.sleeping)
+                self.staleSleepers = 0
+
+    def popSleeper(self):
+        # Private: removes the first entry from the heap, answering it if it's current, or None if it's stale.
+        entry = heapq.heappop(self.sleeping)
+        _, sleepId, record = entry
+        if record.sleepId != sleepId:
+            self.staleSleepers -= 1
+            return None
+        record.inSleepHeap = False
+        return entry
+
+    def nextWakeupTime(self):
+        # Private: answers the time the first sleeping coroutine is due, or None if none is, discarding stale entries.
+        while self.sleeping and self.sleeping[0][2].sleepId != self.sleeping[0][1]:
+            self.popSleeper()
+        return self.sleeping[0][0] if self.sleeping else None
+
+    def wakeSleepingCoroutines(self, timeNow):
+        # Private: makes runnable all the sleeping coroutines due by timeNow, discarding stale heap entries.
+        while self.sleeping and self.sleeping[0][0] <= timeNow:
+            entry = self.popSleeper()
+            if entry:
+                self.wakeFromSleep(entry[2], entry[1])
+
     def setUpdateCoroutine(self, coroutine):
         # Private - set the coroutine that manages the interaction with the BrickPi.
         # The coroutine will be invoked once at the start and once at the end of each doWork call.
         self.updateCoroutine = Scheduler.makeCoroutine(coroutine)
 
     def findCoroutineForGenerator(self, generator):
-        return (c for c in self.coroutines if c.generator == generator).next()
+        'Answers the object the Scheduler invokes for the given generator or Coroutine, or None if it isn\'t running.'
+        record = self.coroutines.get(generator)
+        return record.coroutine if record else None
 
     def stopCoroutine( self, *coroutineList ):
-        'Terminates the given one or more coroutines'
+        'Terminates the given one or more coroutines (ignoring any that have already finished)'
         for generator in coroutineList:
-            coroutine = self.findCoroutineForGenerator(generator)
-            coroutine.stop()
+            record = self.coroutines.get(generator)
+            if record:
+                self.removeCoroutine(record)
+                record.coroutine.stop()
 
     def stopAllCoroutines(self):
         'Terminates all coroutines (except the updater one) - rather drastic!'
-        self.stopCoroutine(*[c.generator for c in self.coroutines]) # Makes a copy of the list - don't want to be changing it.
+        self.stopCoroutine(*self.coroutines.keys()) # Makes a copy of the keys - don't want to be changing the dict.
 
     def numCoroutines( self ):
         'Answers the number of active coroutines'
@@ -132,31 +499,36 @@ class Scheduler():
     def runTillFirstCompletes( *coroutineList ):
         'Coroutine that executes the given coroutines until the first completes, then stops the others and finishes.'
         while True:
+            hints = []
             for coroutine in coroutineList:
                 try:
-                    coroutine.next()
+                    hints.append(coroutine.next())
                 except (StopIteration, StopCoroutineException):
                     return # CW - I don't understand it, but we don't seem to need to terminate the others explicitly.
-            yield
+            yield Wakeup.combine(hints)
 
     @staticmethod
     def runTillAllComplete(*coroutineList ):
         'Coroutine that executes the given coroutines until all have completed or one throws an exception.'
         coroutines = list( coroutineList )
         while coroutines != []:
+            hints = []
             for coroutine in coroutines:
                 try:
-                    coroutine.next()
+                    hints.append(coroutine.next())
                 except (StopIteration, StopCoroutineException):
                     coroutines.remove( coroutine )
-            yield
+            yield Wakeup.combine(hints)
 
     @staticmethod
     def waitMilliseconds( timeMillis ):
-        'Coroutine that waits for timeMillis, then finishes.'
+        '''Coroutine that waits for timeMillis, then finishes.
+        It yields a Wakeup, so the scheduler needn't invoke it (or a coroutine that passes on the values it yields)
+        until it's due.'''
         t = Scheduler.currentTimeMillis()
+        wakeup = Wakeup(t + timeMillis)
         while Scheduler.currentTimeMillis() - t < timeMillis:
-            yield
+            yield wakeup
 
     @staticmethod
     def withTimeout( timeoutMillis, *coroutineList ):
@@ -165,7 +537,17 @@ class Scheduler():
 
     @staticmethod
     def waitFor(function, *args ):
-        'Coroutine that waits until the given function (with optional parameters) returns True.'
+        '''Coroutine that waits until the given function (with optional parameters) returns True.
+        It checks the function at every work call; see waitForNotification for a cheaper alternative.'''
         while not function(*args):
             yield
 
+    @staticmethod
+    def waitForNotification(notifiers, function, *args ):
+        '''Coroutine that waits until the given function (with optional parameters) returns True, only checking
+        it after one of *notifiers* (a Notifier or list of them) has been notified.
+        E.g. waitForNotification(sensor.changed, lambda: sensor.value() < 8)'''
+        wakeup = Wakeup(notifiers = notifiers if isinstance(notifiers, list) else [notifiers])
+        while not function(*args):
+            yield wakeup
+
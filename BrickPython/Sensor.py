@@ -3,6 +3,7 @@
 # Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
 
 import BrickPi
+from Coroutine import Notifier, Wakeup
 
 class Sensor():
     '''Sensor, representing a sensor attached to one of the BrickPi ports.
@@ -49,23 +50,65 @@ class Sensor():
         self.rawValue = 0
         #: Function that gets called with new value as parameter when the value changes - default, none.
         self.callbackFunction = lambda x: 0
+        #: Notifier notified whenever the value changes.
+        self.changed = Notifier()
+        #: The raw values received in the latest update: more than one if the BrickPi is oversampled.
+        self.samples = []
 
     def updateValue(self, newValue):
         # Called by the framework to set the new value for the sensor.
         # We ignore zero values - probably means a comms failure.
         if newValue == 0:
             return
+        self.samples = [newValue]
+        self.setRawValue(newValue)
+
+    def updateSamples(self, rawValues):
+        # Called by the framework when the BrickPi has been oversampled, with all the raw values since the last update.
+        # Zero values are ignored, as for updateValue.
+        samples = [v for v in rawValues if v != 0]
+        if samples:
+            self.samples = samples
+            self.setRawValue(self.combineSamples(samples))
+
+    def setRawValue(self, newValue):
+        # Private: sets the raw value, and the cooked one, notifying if it changes.
         self.rawValue = newValue
         previousValue = self.recentValue
         self.recentValue = self.cookValue(newValue)
         if self.recentValue != previousValue:
             self.callbackFunction(self.recentValue)
+            self.changed.notify()
+
+    def combineSamples(self, rawValues):
+        'Answers the raw value to use given the raw values received in one update (overridable) - by default the latest.'
+        return rawValues[-1]
+
+    def sampleMin(self):
+        'Answers the smallest raw value received in the latest update'
+        return min(self.samples) if self.samples else self.rawValue
+
+    def sampleMax(self):
+        'Answers the largest raw value received in the latest update'
+        return max(self.samples) if self.samples else self.rawValue
+
+    def sampleMean(self):
+        'Answers the mean of the raw values received in the latest update'
+        return float(sum(self.samples)) / len(self.samples) if self.samples else float(self.rawValue)
 
     def waitForChange(self):
         'Coroutine that completes when the sensor value changes'
         previousValue = self.recentValue
+        wakeup = Wakeup(notifiers=[self.changed])
         while self.recentValue == previousValue:
-            yield
+            yield wakeup
+
+    def waitUntil(self, condition):
+        '''Coroutine that completes when *condition*, a function taking the sensor value, returns True.
+        E.g. sensor.waitUntil(lambda value: value <= 8)'''
+        wakeup = Wakeup(notifiers=[self.changed])
+        while not condition(self.value()):
+            yield wakeup
 
     def value(self):
         'Answers the latest sensor value received (overridable)'
@@ -123,6 +166,10 @@ class UltrasonicSensor(Sensor):
         result = int(self.ROUND_TO * round(float(smoothedValue)/self.ROUND_TO))  # Round to nearest 5
         return min(result, UltrasonicSensor.MAX_VALUE)
 
+    def combineSamples(self, rawValues):
+        # Like the smoothing, uses the nearest reading, so oversampling filters out spurious far ones.
+        return min(rawValues)
+
 #     def displayValue(self):
 #         return self.recentRawValues
 
@@ -18,10 +18,11 @@ class TkApplication(BrickPiWrapper):
 
     '''
 
-    def __init__(self, sensorConfiguration={}):
-        '''Initialization: *sensorConfiguration* is a map as passed to BrickPiWrapper'''
-        BrickPiWrapper.__init__(self, sensorConfiguration )
+    def __init__(self, sensorConfiguration={}, boards=None):
+        '''Initialization: *sensorConfiguration* and *boards* are as passed to BrickPiWrapper'''
+        BrickPiWrapper.__init__(self, sensorConfiguration, boards )
         self.root = tk.Tk()
+        self.timerId = None # The pending timerTick, or None while it's running.
 
         self.doInitialization()
 
@@ -41,8 +42,20 @@ class TkApplication(BrickPiWrapper):
 
     def timerTick(self):
         # Private: Does all the coroutine processing, every 20ms or so.
+        self.timerId = None
         self.doWork()
-        self.root.after(int(self.timeMillisToNextCall()), self.timerTick)
+        self.scheduleTimerTick()
+
+    def scheduleTimerTick(self):
+        # Private: schedules the next timerTick, and rescheduling if it may be needed sooner.
+        self.timerId = self.root.after(int(self.timeMillisToNextCall()), self.timerTick)
+        self.workCallsNeeded.addListener(self, self.rescheduleTimerTick)
+
+    def rescheduleTimerTick(self):
+        # Private: replaces the pending timerTick with one at the time now needed.
+        if self.timerId is not None:
+            self.root.after_cancel(self.timerId)
+            self.scheduleTimerTick()
 
     def onKeyPress(self, event):
         '''Default key press handling - answers True if it's handled the key.
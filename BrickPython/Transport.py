@@ -0,0 +1,251 @@
+# Transport
+# Serial transports connecting a BrickPiDriver to a BrickPi board, or to a simulation of one.
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+import os
+import errno
+import select
+import threading
+import logging
+
+#: Environment variable giving the type of the default transport (see createTransport)
+TRANSPORT_VARIABLE = 'BRICKPYTHON_TRANSPORT'
+#: Environment variable giving the serial device for the default transport
+DEVICE_VARIABLE = 'BRICKPYTHON_SERIAL_DEVICE'
+#: The Raspberry Pi UART, to which the BrickPi is connected
+DEFAULT_DEVICE = '/dev/ttyAMA0'
+DEFAULT_BAUDRATE = 500000
+# Linux termios speed values missing from Python 2's termios module, from <asm-generic/termbits.h>
+LINUX_SPEEDS = { 500000: 0o010005, 576000: 0o010006, 921600: 0o010007, 1000000: 0o010010 }
+
+class Transport():
+    '''A serial connection, with the subset of the pyserial interface that the BrickPiDriver uses.
+    Transports are created closed: BrickPiSetup (BrickPiDriver.setup) opens them.
+
+    This implementation is never connected to anything: it can't be opened, and discards anything written.
+    '''
+    #: Read timeout in seconds: ignored, since reads never block.
+    timeout = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def isOpen(self):
+        return False
+
+    def write(self, data):
+        'Writes *data*: a string, bytearray or memoryview.'
+        pass
+
+    def read(self, n):
+        'Answers up to *n* bytes, as a string, without waiting for them.'
+        return ''
+
+    def inWaiting(self):
+        'Answers the number of bytes available to read.'
+        return 0
+
+    def fileno(self):
+        'Answers a file descriptor that select() shows as readable when there is input, or None if there is none.'
+        return None
+
+class PySerialTransport(Transport):
+    'Transport using a pyserial Serial port for the serial device *device*.'
+    def __init__(self, device = DEFAULT_DEVICE, baudrate = DEFAULT_BAUDRATE):
+        import serial # Only needed for this transport.
+        self.port = serial.Serial()
+        self.port.port = device
+        self.port.baudrate = baudrate
+        self.port.timeout = 0
+
+    def open(self):
+        self.port.open()
+
+    def close(self):
+        self.port.close()
+
+    def isOpen(self):
+        return self.port.isOpen()
+
+    def write(self, data):
+        if isinstance(data, memoryview): # Older pyserial versions can't convert memoryviews.
+            data = data.tobytes()
+        self.port.write(data)
+
+    def read(self, n):
+        return self.port.read(n)
+
+    def inWaiting(self):
+        return self.port.inWaiting()
+
+    def fileno(self):
+        return self.port.fileno()
+
+class RawSerialTransport(Transport):
+    '''Transport using the serial device *device* directly, with os.read and os.write on a non-blocking file
+    descriptor set to raw mode with termios.  It avoids pyserial's overhead for each call, so it's the fastest.
+    '''
+    def __init__(self, device = DEFAULT_DEVICE, baudrate = DEFAULT_BAUDRATE):
+        self.device = device
+        self.baudrate = baudrate
+        self.fd = None
+
+    def open(self):
+        if self.fd is not None:
+            return
+        import termios, sys
+        speed = getattr(termios, 'B%d' % self.baudrate, None)
+        if speed is None and sys.platform.startswith('linux'):
+            speed = LINUX_SPEEDS.get(self.baudrate)
+        if speed is None:
+            raise ValueError("Baud rate %d isn't supported here" % self.baudrate)
+        fd = os.open(self.device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            attributes = termios.tcgetattr(fd)
+            attributes[0] = 0                                                # iflag: no input processing
+            attributes[1] = 0                                                # oflag: no output processing
+            attributes[2] = termios.CS8 | termios.CREAD | termios.CLOCAL     # cflag: 8 bits, no parity, one stop bit
+            attributes[3] = 0                                                # lflag: no echo, not canonical
+            attributes[4] = attributes[5] = speed
+            attributes[6][termios.VMIN] = 0
+            attributes[6][termios.VTIME] = 0
+            termios.tcsetattr(fd, termios.TCSANOW, attributes)
+            termios.tcflush(fd, termios.TCIOFLUSH)
+        except:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def isOpen(self):
+        return self.fd is not None
+
+    def write(self, data):
+        data = memoryview(data)
+        while data:
+            try:
+                data = data[os.write(self.fd, data):]
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                select.select([], [self.fd], [])  # Output buffer full: wait for space.
+
+    def read(self, n):
+        try:
+            return os.read(self.fd, n)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return ''
+            raise
+
+    def inWaiting(self):
+        import fcntl, termios, struct
+        return struct.unpack('I', fcntl.ioctl(self.fd, termios.FIONREAD, struct.pack('I', 0)))[0]
+
+    def fileno(self):
+        return self.fd
+
+class PtyTransport(RawSerialTransport):
+    '''Transport using a new pseudo-terminal, for connecting to a simulated BrickPi running in another process
+    or thread.  Once it's open, the simulation opens the serial device *peerName*.
+    '''
+    def __init__(self):
+        RawSerialTransport.__init__(self, None)
+        #: The serial device name of the other end, or None when closed
+        self.peerName = None
+        self.peerFd = None
+
+    def open(self):
+        if self.fd is not None:
+            return
+        import tty
+        self.fd, self.peerFd = os.openpty()
+        tty.setraw(self.peerFd)
+        self.peerName = os.ttyname(self.peerFd)
+        import fcntl
+        fcntl.fcntl(self.fd, fcntl.F_SETFL, fcntl.fcntl(self.fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.peerFd) # Kept open until now, so the transport doesn't see a hang up between connections.
+            self.peerFd = self.peerName = None
+        RawSerialTransport.close(self)
+
+class LoopbackTransport(Transport):
+    '''In-memory transport, for tests and simulations in the same process.  Data written is read at the *peer*:
+    by default the transport itself, as if its transmit and receive lines were joined; see also pair().
+    There's no file descriptor, so the driver polls it for input.
+    '''
+    def __init__(self, peer = None):
+        self.peer = peer if peer is not None else self
+        self.opened = False
+        self.received = bytearray()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def pair():
+        'Answers two LoopbackTransports connected to each other.'
+        first = LoopbackTransport()
+        second = LoopbackTransport(first)
+        first.peer = second
+        return first, second
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+    def isOpen(self):
+        return self.opened
+
+    def write(self, data):
+        peer = self.peer
+        with peer.lock:
+            peer.received += data
+
+    def read(self, n):
+        with self.lock:
+            result = str(self.received[:n])
+            del self.received[:n]
+        return result
+
+    def inWaiting(self):
+        return len(self.received)
+
+#: Transport classes by their names, for createTransport
+TRANSPORTS = { 'raw': RawSerialTransport, 'pyserial': PySerialTransport, 'pty': PtyTransport,
+               'loopback': LoopbackTransport, 'none': Transport }
+
+def createTransport(name = None, device = None, baudrate = DEFAULT_BAUDRATE):
+    '''Answers a new transport of the type *name*: 'raw', 'pyserial', 'pty', 'loopback' or 'none'.
+
+    The default type is given by the environment variable BRICKPYTHON_TRANSPORT.  If that isn't set, it's 'raw'
+    if the serial device exists, as on a Raspberry Pi; otherwise it's 'none', with a warning, and all communication
+    with the BrickPi fails, leaving the sensor values and motor positions at their defaults.
+    *device* defaults to the environment variable BRICKPYTHON_SERIAL_DEVICE, or /dev/ttyAMA0.
+    '''
+    device = device or os.environ.get(DEVICE_VARIABLE) or DEFAULT_DEVICE
+    if name is None:
+        name = os.environ.get(TRANSPORT_VARIABLE)
+    if name is None:
+        if os.path.exists(device):
+            name = 'raw'
+        else:
+            logging.warning("No BrickPi serial device %s: running without a BrickPi (set %s to choose a transport)"
+                            % (device, TRANSPORT_VARIABLE))
+            name = 'none'
+    transportClass = TRANSPORTS.get(name)
+    if transportClass is None:
+        raise ValueError("Unknown BrickPi transport '%s': use one of %s" % (name, ', '.join(sorted(TRANSPORTS))))
+    if transportClass in (RawSerialTransport, PySerialTransport):
+        return transportClass(device, baudrate)
+    return transportClass()
@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))
 
 from BrickPython.TkApplication import TkApplication
 from BrickPython.Sensor import Sensor
+from BrickPython.Coroutine import Notifier
 import logging
 
 class DoorControlApp(TkApplication):
@@ -22,6 +23,7 @@ class DoorControlApp(TkApplication):
     def __init__(self):
         TkApplication.__init__(self, {'1': Sensor.ULTRASONIC_CONT })
         self.doorLocked = False
+        self.doorLockChanged = Notifier()
         self.addSensorCoroutine( self.openDoorWhenSensorDetected() )
 
     def openDoorWhenSensorDetected(self):
@@ -35,12 +37,17 @@ class DoorControlApp(TkApplication):
         motorA.zeroPosition()
         while True:
 
-            while sensor1.value() > 8 or self.doorLocked:
-                yield
+            # Sleep until the sensor value or the lock changes, and then check again:
+            for hint in self.waitForNotification( [sensor1.changed, self.doorLockChanged],
+                                                  lambda: sensor1.value() <= 8 and not self.doorLocked ):
+                yield hint
 
             logging.info( "Opening - sensor 1 value is %d" % sensor1.value() )
-            for i in motorA.moveTo( -2*90, 2000 ):
-                if self.doorLocked: break
+            move = self.addActionCoroutine( motorA.moveTo( -2*90, 2000 ) ) # Added separately, so it runs as critical
+            while self.stillRunning( move ):
+                if self.doorLocked:
+                    self.stopCoroutine( move )
+                    break
                 yield
 
 
@@ -50,7 +57,8 @@ class DoorControlApp(TkApplication):
                 yield
 
             logging.info( "Shutting door" )
-            for i in motorA.moveTo( 0, 2000 ):
+            move = self.addActionCoroutine( motorA.moveTo( 0, 2000 ) )
+            while self.stillRunning( move ):
                 yield
 
             logging.info( "Door closed" )
@@ -64,10 +72,12 @@ class DoorControlApp(TkApplication):
         if char in 'Cc':
             logging.info( "Closing and disabling door now" )
             self.doorLocked = True
+            self.doorLockChanged.notify()
 
         elif char in 'SsOo':
             logging.info( "Re-activating door" )
             self.doorLocked = False
+            self.doorLockChanged.notify()
 
 
 
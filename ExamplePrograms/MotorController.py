@@ -35,7 +35,7 @@ class MotorControllerApp(TkApplication):
         motor = self.motor('A')
         logging.info( "Rotating motor A %d degrees" % degrees )
         co = motor.moveTo( motor.position() + degrees*2 )
-        self.addActionCoroutine( co )
+        self.addCoroutine( co, self.PRIORITY_CRITICAL )
 
     def setSpeed(self, speed):
         'Set the speed of motor A'
@@ -43,7 +43,7 @@ class MotorControllerApp(TkApplication):
         motor = self.motor('A')
         logging.info( "Speed for motor A %.2f" % speed )
         co = motor.runAtConstantSpeed( speed )
-        self.addActionCoroutine( co )
+        self.addCoroutine( co, self.PRIORITY_CRITICAL )
 
     def onKeyPress(self, event):
         'Handle user keystroke'
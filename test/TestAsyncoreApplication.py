@@ -0,0 +1,83 @@
+# Tests for AsyncoreApplication
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.AsyncoreApplication import AsyncoreApplication
+from BrickPython.Coroutine import Notifier
+from BrickPython.Scheduler import Scheduler
+import asyncore
+import socket
+import time
+import unittest
+from mock import patch
+
+class NotifyingDispatcher(asyncore.dispatcher):
+    'Dispatcher that records the data it receives, and notifies a Notifier for each batch of it.'
+    def __init__(self, sock, socketMap):
+        asyncore.dispatcher.__init__(self, sock, map=socketMap)
+        self.received = ''
+        self.notifier = Notifier()
+
+    def handle_read(self):
+        self.received += self.recv(100)
+        self.notifier.notify()
+
+    def writable(self):
+        return False
+
+class TestAsyncoreApplication(unittest.TestCase):
+    'Tests for AsyncoreApplication, and how it shares its thread between work calls and socket handling'
+
+    def setUp(self):
+        self.socketMap = {}
+        self.app = AsyncoreApplication( socketMap = self.socketMap )
+
+    def tearDown(self):
+        for dispatcher in self.socketMap.values():
+            dispatcher.close()
+
+    def testDoesTheWorkCallWhenItIsDue(self):
+        with patch.object(self.app, 'timeMillisToNextCall', return_value = 0), \
+                patch.object(self.app, 'doWork') as doWork, \
+                patch('asyncore.loop') as loop:
+            self.app.handleEvents()
+        self.assertTrue( doWork.called )
+        self.assertFalse( loop.called )
+
+    def testServesSocketsUntilTheNextWorkCall(self):
+        ours, theirs = socket.socketpair()
+        try:
+            dispatcher = NotifyingDispatcher(ours, self.socketMap)
+            # Given a coroutine waiting for data from the dispatcher
+            def waitForData():
+                for hint in Scheduler.waitForNotification(dispatcher.notifier, lambda: dispatcher.received != ''):
+                    yield hint
+            self.app.addActionCoroutine( waitForData() )
+            self.app.doWork()
+            self.assertEquals( self.app.numCoroutines(), 1 )
+            theirs.send('Hello')
+            # when the next work call isn't due, handleEvents serves the dispatcher without waiting for the timeout,
+            with patch.object(self.app, 'timeMillisToNextCall', return_value = 10000), \
+                    patch.object(self.app, 'doWork') as doWork:
+                startTime = time.time()
+                self.app.handleEvents()
+                self.assertTrue( time.time() - startTime < 5 )
+            self.assertFalse( doWork.called )
+            self.assertEquals( dispatcher.received, 'Hello' )
+            # and its notification wakes the coroutine at the next work call.
+            time.sleep(0.001)
+            self.app.doWork()
+            self.assertEquals( self.app.numCoroutines(), 0 )
+        finally:
+            theirs.close()
+
+    def testWaitsForTheNextWorkCallWithoutSockets(self):
+        with patch.object(self.app, 'timeMillisToNextCall', return_value = 20), \
+                patch.object(self.app, 'doWork') as doWork, \
+                patch('time.sleep') as sleep:
+            self.app.handleEvents()
+        sleep.assert_called_with( 0.02 )
+        self.assertFalse( doWork.called )
+
+if __name__ == '__main__':
+    unittest.main()
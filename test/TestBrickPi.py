@@ -0,0 +1,345 @@
+# Tests for the BrickPi driver module
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+import BrickPython.BrickPi as BP
+from BrickPython.BrickPi import FrameEncoder, FrameDecoder
+import unittest
+import random
+import os
+import time
+import select
+import threading
+from mock import patch
+from BrickPython.Transport import LoopbackTransport
+
+class FakeSerial():
+    'Serial port delivering the given replies, each as one read.'
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.written = []
+    def write(self, data):
+        self.written.append(bytes(bytearray(data)))
+    def isOpen(self):
+        return True
+    def inWaiting(self):
+        return len(self.replies[0]) if self.replies else 0
+    def read(self, n):
+        return self.replies.pop(0)
+
+class PipeSerial():
+    'Serial port reading from a pipe, counting the calls to inWaiting.'
+    def __init__(self):
+        self.readFd, self.writeFd = os.pipe()
+        self.buffered = ''
+        self.inWaitingCalls = 0
+    def close(self):
+        os.close(self.readFd)
+        os.close(self.writeFd)
+    def fileno(self):
+        return self.readFd
+    def isOpen(self):
+        return True
+    def inWaiting(self):
+        self.inWaitingCalls += 1
+        if not self.buffered and select.select([self.readFd], [], [], 0)[0]:
+            self.buffered = os.read(self.readFd, 1000)
+        return len(self.buffered)
+    def read(self, n):
+        result, self.buffered = self.buffered[:n], self.buffered[n:]
+        return result
+
+class LoopbackBoard(threading.Thread):
+    '''Simulated BrickPi at the far end of a LoopbackTransport, replying to each message in turn.  The encoder
+    values from each chip are ten times its address, and each reply is delayed by the next of *delays* (in seconds).'''
+    def __init__(self, transport, delays = ()):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.transport = transport
+        self.delays = list(delays)
+        self.stopping = False
+    def reply(self, address):
+        encoder = FrameEncoder()
+        value = address * 10 * 2
+        for port in range(2):
+            encoder.add(5, 6)
+        for port in range(2):
+            encoder.add(6, value)
+        for port in range(2):
+            encoder.add(10, address)
+        data = [BP.MSG_TYPE_VALUES] + [0] * encoder.byteCount()
+        encoder.writeTo(data, 1)
+        return chr((len(data) + sum(data)) % 256) + chr(len(data)) + ''.join(chr(b) for b in data)
+    def run(self):
+        received = ''
+        while not self.stopping:
+            received += self.transport.read(1000)
+            if len(received) >= 3 and len(received) >= 3 + ord(received[2]):
+                address = ord(received[0])
+                received = received[3 + ord(received[2]):]
+                if self.delays:
+                    time.sleep(self.delays.pop(0))
+                self.transport.write(self.reply(address))
+            else:
+                time.sleep(0.0001)
+    def stop(self):
+        self.stopping = True
+        self.join()
+
+class TestBrickPi(unittest.TestCase):
+    'Tests for the BrickPi message encoding and decoding'
+
+    @staticmethod
+    def randomFields(count):
+        fields = []
+        for i in range(count):
+            bits = random.randint(1, 32)
+            fields.append( (bits, random.randint(0, (1 << bits) - 1)) )
+        return fields
+
+    @staticmethod
+    def encodeWithAddBits(fields, byte_offset):
+        # The original bit-by-bit encoder, for comparison.
+        BP.Array = [0] * 256
+        BP.Bit_Offset = 0
+        for bits, value in fields:
+            BP.AddBits(byte_offset, 0, bits, value)
+        return list(BP.Array)
+
+    def setUp(self):
+        random.seed(1)
+        self.savedState = (BP.Array, BP.Bit_Offset, BP.BrickPi.SensorType[:], BP.BrickPi.SensorInUse[:],
+                           BP.BrickPi.MotorSpeed[:], BP.BrickPi.MotorEnable[:])
+        BP.BrickPi.SensorInUse[:] = [True] * 4
+
+    def tearDown(self):
+        (BP.Array, BP.Bit_Offset, BP.BrickPi.SensorType[:], BP.BrickPi.SensorInUse[:],
+                           BP.BrickPi.MotorSpeed[:], BP.BrickPi.MotorEnable[:]) = self.savedState
+
+    def testEncoderMatchesAddBits(self):
+        for trial in range(50):
+            fields = TestBrickPi.randomFields(random.randint(0, 30))
+            array = [0] * 256
+            encoder = FrameEncoder()
+            for bits, value in fields:
+                encoder.add(bits, value)
+            encoder.writeTo(array, 1)
+            self.assertEquals( array, TestBrickPi.encodeWithAddBits(fields, 1) )
+            self.assertEquals( encoder.byteCount(), (BP.Bit_Offset + 7) / 8 )
+
+    def testDecoderMatchesGetBits(self):
+        for trial in range(50):
+            fields = TestBrickPi.randomFields(random.randint(1, 30))
+            array = TestBrickPi.encodeWithAddBits(fields, 1)
+            decoder = FrameDecoder(array, 1)
+            BP.Bit_Offset = 0
+            for bits, value in fields:
+                self.assertEquals( decoder.get(bits), value )
+                self.assertEquals( BP.GetBits(1, 0, bits), value )
+
+    def testUpdateValuesEncodesAndDecodesWholeMessages(self):
+        BP.BrickPi.SensorType[:] = [BP.TYPE_SENSOR_TOUCH, BP.TYPE_SENSOR_ULTRASONIC_CONT, BP.TYPE_SENSOR_COLOR_FULL, BP.TYPE_SENSOR_RAW]
+        BP.BrickPi.MotorSpeed[:] = [100, -300, 0, 5]
+        BP.BrickPi.MotorEnable[:] = [1, 1, 0, 1]
+        # Replies from each chip, encoded bit by bit: encoder bit counts and values, then the sensor values.
+        replies = [ [(5, 8), (5, 9), (8, 2 * 100), (9, 2 * 200 + 1), (1, 1), (8, 57)],
+                    [(5, 3), (5, 4), (3, 2 * 3), (4, 2 * 7), (3, 5), (10, 11), (10, 12), (10, 13), (10, 14), (10, 1023)] ]
+        rxResults = []
+        for reply in replies:
+            array = TestBrickPi.encodeWithAddBits(reply, 1)
+            array[BP.BYTE_MSG_TYPE] = BP.MSG_TYPE_VALUES
+            rxResults.append( (0, 20, array[:20]) )
+        sent = []
+        def tx(address, byteCount, array):
+            sent.append( (address, byteCount, array[:byteCount]) )
+        with patch.object(BP.Driver, 'tx', side_effect = tx), patch.object(BP.Driver, 'rx', side_effect = rxResults):
+            self.assertEquals( BP.BrickPiUpdateValues(), 0 )
+        # The messages sent match the bit-by-bit encoding
+        self.assertEquals( len(sent), 2 )
+        for i, (address, byteCount, array) in enumerate(sent):
+            fields = [(1, 0), (1, 0)] + [(10, (min(abs(speed), 255) << 2) | ((speed < 0) << 1) | enable)
+                            for speed, enable in zip(BP.BrickPi.MotorSpeed[2*i:2*i+2], BP.BrickPi.MotorEnable[2*i:2*i+2])]
+            expected = TestBrickPi.encodeWithAddBits( fields, 1 )
+            expected[BP.BYTE_MSG_TYPE] = BP.MSG_TYPE_VALUES
+            self.assertEquals( address, BP.BrickPi.Address[i] )
+            self.assertEquals( list(array), expected[:byteCount] )
+        # and the values received are decoded.
+        self.assertEquals( BP.BrickPi.Encoder, [100, -200, 3, 7] )
+        self.assertEquals( BP.BrickPi.Sensor, [1, 57, 5, 1023] )
+        self.assertEquals( BP.BrickPi.SensorArray[2], [12, 13, 14, 11] )
+
+    def testFramePlanIsReusedUntilTheSensorsChange(self):
+        BP.BrickPi.SensorType[:] = [BP.TYPE_SENSOR_TOUCH, BP.TYPE_SENSOR_RAW, BP.TYPE_SENSOR_RAW, BP.TYPE_SENSOR_RAW]
+        plan = BP.BrickPiPlanFrames()
+        BP.BrickPi.MotorSpeed[0] = 20
+        size1, array1 = plan.chips[0].encode()
+        BP.BrickPi.MotorSpeed[0] = 30
+        size2, array2 = plan.chips[0].encode()
+        # Only the motor fields change, in the same buffer
+        self.assertTrue( array1 is array2 )
+        self.assertEquals( (size1, size2), (4, 4) )
+        expected = TestBrickPi.encodeWithAddBits([(1, 0), (1, 0), (10, 30 << 2), (10, BP.MotorField(BP.BrickPi, 1))], 1)
+        self.assertEquals( list(array2[1:size2]), expected[1:size2] )
+        self.assertTrue( BP.BrickPiPlanFrames() is plan )
+        # until the sensor configuration changes.
+        BP.BrickPi.SensorType[1] = BP.TYPE_SENSOR_ULTRASONIC_CONT
+        self.assertFalse( BP.BrickPiPlanFrames() is plan )
+
+    def testEncoderOffsetsAreEncodedInFull(self):
+        savedOffsets = BP.BrickPi.EncoderOffset[:]
+        try:
+            BP.BrickPi.EncoderOffset[:2] = [5, -6]
+            BP.BrickPi.MotorSpeed[:2] = [1, 2]
+            size, array = BP.BrickPiPlanFrames().chips[0].encode()
+        finally:
+            BP.BrickPi.EncoderOffset[:] = savedOffsets
+        expected = TestBrickPi.encodeWithAddBits([(1, 1), (5, 4), (4, 5 * 2), (1, 1), (5, 4), (4, 6 * 2 + 1),
+                                                  (10, 1 << 2), (10, 2 << 2)], 1)
+        self.assertEquals( list(array[1:size]), expected[1:size] )
+
+    def testMessagesAreSentAndReceivedWithChecksums(self):
+        data = [BP.MSG_TYPE_VALUES, 7, 200]
+        reply = chr((len(data) + sum(data)) % 256) + chr(len(data)) + ''.join(chr(b) for b in data)
+        ser = FakeSerial(reply)
+        driver = BP.BrickPiDriver(ser)
+        driver.tx(1, 3, data + [0] * 10)
+        self.assertEquals( ser.written, ['\x01\xd6\x03\x03\x07\xc8'] )
+        result, count, inArray = driver.rx(0.001)
+        self.assertEquals( (result, count, list(inArray)), (0, 3, data) )
+        # A corrupt message fails the checksum
+        ser.replies.append( 'x' + reply[1:] )
+        self.assertEquals( driver.rx(0.001)[0], -5 )
+        # and no message times out.
+        self.assertEquals( driver.rx(0.001)[0], -2 )
+
+    def testReceiveBlocksRatherThanPolling(self):
+        ser = PipeSerial()
+        try:
+            with patch.object(BP.Driver, 'ser', ser):
+                # With nothing to receive, it times out without polling the port
+                startTime = time.time()
+                self.assertEquals( BP.BrickPiRx(0.02)[0], -2 )
+                self.assertTrue( time.time() - startTime >= 0.02 )
+                self.assertEquals( ser.inWaitingCalls, 0 )
+                # and it returns the data when there is some.
+                os.write(ser.writeFd, '\x05\x02\x01\x02')
+                self.assertEquals( BP.BrickPiRx(0.02)[:2], (0, 2) )
+        finally:
+            ser.close()
+
+    def testReceiveReassemblesSplitMessagesAndSkipsGarbage(self):
+        data = [BP.MSG_TYPE_VALUES, 1, 2, 3]
+        reply = chr((len(data) + sum(data)) % 256) + chr(len(data)) + ''.join(chr(b) for b in data)
+        ser = PipeSerial()
+        try:
+            with patch.object(BP.Driver, 'ser', ser):
+                # When a message arrives in two parts, after some garbage
+                os.write(ser.writeFd, '\xff\x07' + reply[:3])
+                timer = threading.Timer(0.002, os.write, [ser.writeFd, reply[3:]])
+                timer.start()
+                result, count, inArray = BP.BrickPiRx(0.02, BP.MSG_TYPE_VALUES)
+                timer.join()
+            # It's received complete.
+            self.assertEquals( (result, count, list(inArray)), (0, 4, data) )
+        finally:
+            ser.close()
+
+    def testCorruptMessagesAreRejectedRatherThanSearched(self):
+        data = [BP.MSG_TYPE_VALUES, 0x40, 0x41, 0x42, 0x43]
+        reply = bytearray([(len(data) + sum(data)) % 256 ^ 0x01, len(data)] + data)
+        reassembler = BP.FrameReassembler()
+        reassembler.add(reply)
+        # A complete message with a bad checksum is an error, even if there's something valid-looking inside it
+        self.assertEquals( reassembler.message(), (-5, None) )
+        self.assertEquals( reassembler.message(BP.MSG_TYPE_VALUES), (-5, None) )
+        # and a message of the wrong type isn't accepted.
+        reply[0] ^= 0x01
+        reassembler.reset()
+        reassembler.add(reply)
+        self.assertEquals( reassembler.message(BP.MSG_TYPE_VALUES)[0], 0 )
+        self.assertNotEquals( reassembler.message(BP.MSG_TYPE_SENSOR_TYPE)[0], 0 )
+
+    def testChipsAreOnlyUsedIfTheyHaveSensorsOrEnabledMotors(self):
+        BP.BrickPi.SensorInUse[:] = [True, False, False, False]
+        BP.BrickPi.MotorEnable[:] = [0, 0, 0, 0]
+        reply = [BP.MSG_TYPE_VALUES] + [0] * 4
+        def addressesSent():
+            sent = []
+            def tx(address, byteCount, array):
+                sent.append(address)
+            with patch.object(BP.Driver, 'tx', side_effect = tx), \
+                    patch.object(BP.Driver, 'rx', return_value = (0, len(reply), reply)):
+                BP.BrickPiUpdateValues()
+            return sent
+        # Both chips are read the first time
+        self.assertEquals( addressesSent(), BP.BrickPi.Address )
+        # but then only the first, which has sensors in use
+        self.assertEquals( addressesSent(), [BP.BrickPi.Address[0]] )
+        self.assertEquals( BP.Driver.chipsSkipped, [False, True] )
+        # The second is used as soon as one of its motors is enabled
+        BP.BrickPi.MotorEnable[2] = 1
+        self.assertEquals( addressesSent(), BP.BrickPi.Address )
+        # and once more, to disable it.
+        BP.BrickPi.MotorEnable[2] = 0
+        self.assertEquals( addressesSent(), BP.BrickPi.Address )
+        self.assertEquals( addressesSent(), [BP.BrickPi.Address[0]] )
+
+    def testReceiveTimeoutAdaptsToTheRoundTripTime(self):
+        timer = BP.RoundTripTimer()
+        self.assertEquals( timer.retryTimeout(0), BP.RX_TIMEOUT_INITIAL )
+        # Consistent fast replies bring the timeout down to the minimum
+        for i in range(50):
+            timer.addSample(0.0005)
+        self.assertEquals( timer.retryTimeout(0), BP.RX_TIMEOUT_MIN )
+        # and retries back off from there.
+        self.assertEquals( timer.retryTimeout(2), BP.RX_TIMEOUT_MIN * 4 )
+        # Slow replies increase it, up to the maximum.
+        timer.addSample(0.002)
+        self.assertTrue( BP.RX_TIMEOUT_MIN < timer.retryTimeout(0) < BP.RX_TIMEOUT_MAX )
+        for i in range(50):
+            timer.addSample(1)
+        self.assertEquals( timer.retryTimeout(0), BP.RX_TIMEOUT_MAX )
+
+    def testEachDriverHasItsOwnBoardState(self):
+        data = [BP.MSG_TYPE_VALUES, 7, 200]
+        reply = chr((len(data) + sum(data)) % 256) + chr(len(data)) + ''.join(chr(b) for b in data)
+        ser1, ser2 = FakeSerial(reply), FakeSerial()
+        driver1, driver2 = BP.BrickPiDriver(ser1), BP.BrickPiDriver(ser2)
+        driver1.brickPi.MotorSpeed[0] = 100
+        self.assertEquals( driver2.brickPi.MotorSpeed[0], 0 )
+        self.assertEquals( BP.BrickPi.MotorSpeed[0], 0 )
+        # Each uses its own port
+        self.assertEquals( driver1.rx(0.001)[0], 0 )
+        self.assertEquals( driver2.rx(0.001)[0], -2 )
+        # and the module functions use the default driver.
+        self.assertTrue( BP.Driver.brickPi is BP.BrickPi )
+
+    def testLateRepliesAreNotTakenForTheOtherChip(self):
+        transport, boardEnd = LoopbackTransport.pair()
+        driver = BP.BrickPiDriver(transport)
+        driver.setup()
+        driver.brickPi.SensorType[:] = [BP.TYPE_SENSOR_RAW] * 4
+        for timer in driver.roundTripTimers: # The timeout has adapted to fast replies
+            for i in range(50):
+                timer.addSample(0.0005)
+        # when a reply arrives after it, and the reply to the retry is also slow.
+        board = LoopbackBoard(boardEnd, [0.004, 0.002])
+        board.start()
+        try:
+            for i in range(30):
+                self.assertEquals( driver.updateValues(), 0 )
+                self.assertEquals( driver.brickPi.Encoder, [10, 10, 20, 20] )
+                self.assertEquals( driver.brickPi.Sensor, [1, 1, 2, 2] )
+        finally:
+            board.stop()
+
+    def testRepliesTooShortForTheChipAreRejected(self):
+        driver = BP.BrickPiDriver(None)
+        driver.brickPi.SensorType[:] = [BP.TYPE_SENSOR_RAW, BP.TYPE_SENSOR_COLOR_FULL, BP.TYPE_SENSOR_TOUCH, BP.TYPE_SENSOR_TOUCH]
+        plan = driver.planFrames()
+        reply = [BP.MSG_TYPE_VALUES] + [0] * 2 # Encoder bit counts of 0, and 2 bits of touch sensor values
+        self.assertTrue( plan.chips[1].replyFits(reply) )
+        self.assertFalse( plan.chips[0].replyFits(reply) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,7 +17,13 @@ from BrickPython.BrickPiWrapper import BrickPiWrapper
 from BrickPython.BrickPi import BrickPi, PORT_1, TYPE_SENSOR_ULTRASONIC_CONT,\
     TYPE_SENSOR_RAW
 from BrickPython.Sensor import Sensor
+from BrickPython.Scheduler import Scheduler
+import BrickPython.BrickPi as BP
 import unittest
+import time
+import threading
+from mock import patch
+from BrickPython.Transport import Transport
 
 
 class TestBrickPiWrapper(unittest.TestCase):
@@ -43,6 +49,160 @@ class TestBrickPiWrapper(unittest.TestCase):
         assert( isinstance( s.value(), int ) )
         assert( s.idChar == '1' )
 
+    def testMotorsShareOneTimestampPerUpdate(self):
+        bp = BrickPiWrapper()
+        bp.update()
+        times = set( motor.currentTP.time for motor in bp.motors.values() )
+        self.assertEquals( len(times), 1 )
+
+    def testUpdatesUseTheWorkCallTimestamp(self):
+        bp = BrickPiWrapper()
+        bp.singleUpdatePerWorkCall = True
+        with patch.object(Scheduler, 'currentTimeMillis', side_effect = xrange(1000, 2000)): # Each read is later.
+            bp.doWork()
+        # The motors were updated with the time the work call read, rather than reading the clock again.
+        self.assertEquals( bp.motor('A').currentTP.time, 1000 )
+        self.assertEquals( bp.workCallTimeMillis(), 1000 )
+
+    def testIdleWorkCallRate(self):
+        bp = BrickPiWrapper()
+        bp.idleTimeMillisBetweenWorkCalls = 500
+        def waitingCoroutine():
+            while True:
+                yield
+        # With nothing to do, the work calls back off to the idle rate
+        self.assertEquals( bp.workCallIntervalMillis(), 500 )
+        # but return to the normal rate when a motor is enabled
+        bp.motor('A').enable(True)
+        self.assertEquals( bp.workCallIntervalMillis(), 50 )
+        bp.motor('A').enable(False)
+        # or there's a coroutine to invoke at every work call.
+        bp.addActionCoroutine(waitingCoroutine())
+        self.assertEquals( bp.workCallIntervalMillis(), 50 )
+        # A coroutine with a long period doesn't count.
+        bp.stopAllCoroutines()
+        bp.addCoroutine(waitingCoroutine(), periodMillis = 1000)
+        self.assertEquals( bp.workCallIntervalMillis(), 500 )
+
+    def testIOThreadExchangesSnapshotsWithTheBrickPi(self):
+        def fakeUpdateValues():
+            BP.BrickPi.Encoder[0] = BP.BrickPi.MotorSpeed[0] * 2
+        with patch.object(BP.Driver, 'updateValues', side_effect = fakeUpdateValues) as updateValues:
+            bp = BrickPiWrapper()
+            bp.startIOThread(1)
+            try:
+                # Updates pass the motor settings to the thread
+                bp.motor('A').setPower(50)
+                bp.update()
+                # and pick up the values it receives.
+                for i in range(100):
+                    time.sleep(0.01)
+                    bp.update()
+                    if bp.motor('A').position() == 100:
+                        break
+                self.assertEquals( bp.motor('A').position(), 100 )
+            finally:
+                bp.stopIOThread()
+            self.assertTrue( updateValues.called )
+            self.assertFalse( bp.boards[0].ioThread )
+
+    def testSeveralBoardsHaveNamespacedPortsAndUpdateConcurrently(self):
+        driver2 = BP.BrickPiDriver(Transport())
+        bp = BrickPiWrapper( {'1': Sensor, '2:3': Sensor}, boards = [BP.Driver, driver2] )
+        # Ports on the second board have its number as a prefix
+        self.assertEquals( bp.motor('2:A').idChar, '2:A' )
+        self.assertFalse( bp.motor('2:A') is bp.motor('A') )
+        self.assertTrue( bp.motor('1:A') is bp.motor('A') )
+        self.assertEquals( driver2.brickPi.SensorInUse, [False, False, True, False] )
+        # and each update exchanges values with both boards at once.
+        threads = []
+        def fakeUpdateValues(driver, value):
+            def updateValues():
+                threads.append( threading.current_thread() )
+                driver.brickPi.Encoder[0] = driver.brickPi.Sensor[2] = value
+            return updateValues
+        bp.motor('2:A').setPower(50)
+        with patch.object(BP.Driver, 'updateValues', side_effect = fakeUpdateValues(BP.Driver, 10)), \
+                patch.object(driver2, 'updateValues', side_effect = fakeUpdateValues(driver2, 20)):
+            bp.update()
+        exchangeThread = bp.boards[1].exchangeThread
+        bp.shutdown()
+        self.assertFalse( exchangeThread.is_alive() )
+        self.assertEquals( bp.boards[1].exchangeThread, None )
+        self.assertEquals( driver2.brickPi.MotorSpeed[0], 50 )
+        self.assertEquals( (bp.motor('A').position(), bp.motor('2:A').position()), (10, 20) )
+        self.assertEquals( bp.sensor('2:3').value(), 20 )
+        self.assertEquals( len(set(threads)), 2 )
+
+    def testUpdateWaitsForTheOtherBoardsWhenTheFirstFails(self):
+        driver2 = BP.BrickPiDriver(Transport())
+        bp = BrickPiWrapper( boards = [BP.Driver, driver2] )
+        exchanged = []
+        def slowUpdateValues():
+            time.sleep(0.05)
+            exchanged.append( True )
+        try:
+            with patch.object(BP.Driver, 'updateValues', side_effect = IOError("Serial port failed")), \
+                    patch.object(driver2, 'updateValues', side_effect = slowUpdateValues):
+                self.assertRaises( IOError, bp.update )
+                # The second board's exchange has finished, so its driver is free to use.
+                self.assertEquals( exchanged, [True] )
+        finally:
+            bp.shutdown()
+
+    def testMotorsOnAChipWithoutSensorsStartFromTheirActualPositions(self):
+        driver = BP.BrickPiDriver(Transport())
+        encoders = {1: 0, 2: 500} # Encoder values for each chip address
+        sent = []
+        def tx(address, byteCount, array):
+            sent.append( (address, array[0], list(array[1:byteCount])) )
+        def rx(timeout, msgType):
+            if msgType != BP.MSG_TYPE_VALUES:
+                return 0, 1, [msgType]
+            value = encoders[sent[-1][0]] * 2
+            encoder = BP.FrameEncoder()
+            for field in [(5, 12), (5, 12), (12, value), (12, value), (10, 0), (10, 0)]:
+                encoder.add(*field)
+            reply = [BP.MSG_TYPE_VALUES] + [0] * encoder.byteCount()
+            encoder.writeTo(reply, 1)
+            return 0, len(reply), reply
+        with patch.object(driver, 'tx', side_effect = tx), patch.object(driver, 'rx', side_effect = rx):
+            bp = BrickPiWrapper( {'1': Sensor}, boards = [driver] )
+            # Both chips are configured, and read
+            self.assertEquals( [address for address, msgType, data in sent if msgType == BP.MSG_TYPE_SENSOR_TYPE], [1, 2] )
+            motor = bp.motor('C')
+            self.assertEquals( motor.position(), 500 )
+            motor.zeroPosition()
+            self.assertEquals( motor.basePosition, 500 )
+            # While the second chip is skipped, motor C's position is stale
+            encoders[2] = 600
+            bp.update()
+            self.assertTrue( motor.positionStale )
+            # so moveTo waits for the update that reads it before setting a power.
+            bp.addActionCoroutine( motor.moveTo(100) )
+            bp.doWork()
+            self.assertEquals( motor.position(), 100 )
+            self.assertFalse( motor.positionStale )
+            self.assertEquals( sent[-1][2], [1 << 2, 0, 0] ) # Motor C enabled, at zero power
+            bp.doWork()
+            self.assertTrue( abs(motor.power()) < 100 )
+            bp.stopAllCoroutines()
+
+    def testMotorsMoveWithoutABoardAttached(self):
+        # Every exchange fails, so no position is read, but none is stale either
+        bp = BrickPiWrapper( boards = [BP.BrickPiDriver(Transport())] )
+        motor = bp.motor('C')
+        bp.update()
+        self.assertFalse( motor.positionStale )
+        # and moveTo runs the PID algorithm straight away, as it would in a simulation.
+        bp.addActionCoroutine( motor.moveTo(100) )
+        for i in range(2):
+            time.sleep(0.001)
+            bp.doWork()
+        self.assertTrue( motor.enabled() )
+        self.assertTrue( motor.power() > 0 )
+        bp.stopAllCoroutines()
+
     def testSensorSetup(self):
         bp = BrickPiWrapper( {PORT_1: TYPE_SENSOR_ULTRASONIC_CONT} )
         assert( BrickPi.SensorType[PORT_1] == TYPE_SENSOR_ULTRASONIC_CONT)
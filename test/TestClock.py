@@ -0,0 +1,46 @@
+# Tests for Clock
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.Clock import MonotonicClock
+from BrickPython.Coroutine import Coroutine
+from BrickPython.Scheduler import Scheduler
+import unittest
+import threading
+from mock import Mock
+
+class TestClock(unittest.TestCase):
+    'Tests for the clocks, and how the Scheduler uses them'
+
+    def testMonotonicClockStartsAtZeroAndNeverGoesBackwards(self):
+        clock = MonotonicClock()
+        times = [clock.timeMillis() for i in range(1000)]
+        self.assertTrue( 0 <= times[0] < 1000 )
+        self.assertEquals( times, sorted(times) )
+
+    def testMonotonicClockNeverGoesBackwardsInConcurrentThreads(self):
+        clock = MonotonicClock()
+        results = []
+        def readTimes():
+            times = [clock.timeMillis() for i in range(10000)]
+            results.append( times == sorted(times) )
+        threads = [threading.Thread(target=readTimes) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals( results, [True] * 4 )
+
+    def testSchedulerUsesTheClockSet(self):
+        oldClock = Coroutine.clock
+        try:
+            clock = Mock()
+            clock.timeMillis.return_value = 1234.0
+            Scheduler.setClock( clock )
+            self.assertEquals( Scheduler.currentTimeMillis(), 1234.0 )
+            self.assertEquals( Coroutine.currentTimeMillis(), 1234.0 )
+        finally:
+            Scheduler.setClock( oldClock )
+
+if __name__ == '__main__':
+    unittest.main()
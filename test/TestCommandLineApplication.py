@@ -0,0 +1,47 @@
+# Tests for CommandLineApplication
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.CommandLineApplication import CommandLineApplication
+from BrickPython.Coroutine import Coroutine
+import unittest
+import time
+import threading
+
+class TestCommandLineApplication(unittest.TestCase):
+    'Tests for CommandLineApplication, especially running as a simulation'
+
+    def setUp(self):
+        self.oldClock = Coroutine.clock
+
+    def tearDown(self):
+        Coroutine.clock = self.oldClock
+
+    def testSimulationRunsFasterThanRealTime(self):
+        app = CommandLineApplication( simulation = True )
+        # When we run a motor movement that times out after 3 seconds, and a 30 second wait
+        app.addActionCoroutine( app.motor('A').moveTo( 100, 3000 ) )
+        app.addActionCoroutine( app.waitMilliseconds( 30*1000 ) )
+        startTime = time.time()
+        app.runFor( 60*1000 )
+        # Both complete
+        self.assertEquals( app.numCoroutines(), 0 )
+        # in virtual time, at the right time,
+        self.assertTrue( 60*1000 <= app.virtualClock.timeMillis() < 60*1000 + 100 )
+        # but much faster in real time.
+        self.assertTrue( time.time() - startTime < 30 )
+
+    def testEnablingAMotorEndsAnIdleWaitStraightAway(self):
+        app = CommandLineApplication()
+        app.idleTimeMillisBetweenWorkCalls = 2000
+        app.doWork()
+        # While waiting at the idle rate, when another thread enables a motor
+        threading.Timer( 0.05, app.motor('A').enable, [True] ).start()
+        startTime = time.time()
+        app.waitForNextWorkCall()
+        # the next work call doesn't wait for the rest of the idle interval.
+        self.assertTrue( time.time() - startTime < 1 )
+        self.assertEquals( app.timeMillisToNextCall(), 0 )
+
+if __name__ == '__main__':
+    unittest.main()
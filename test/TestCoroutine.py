@@ -12,6 +12,7 @@
 from BrickPython.Coroutine import *
 import unittest
 import logging
+import threading
 from mock import *
 
 logging.basicConfig(format='%(message)s', level=logging.DEBUG) # Logging is a simple print
@@ -97,6 +98,50 @@ class TestCoroutine(unittest.TestCase):
         coroutine.call()
         self.assertFalse(coroutine.is_alive(), "Coroutine should have finished")
 
+    def testCoroutineWaitMillisecondsAnswersWakeup(self):
+        coroutine = Coroutine(Coroutine.waitMilliseconds, 1000)
+        # Each call answers the time the coroutine next needs calling.
+        self.assertEquals(coroutine.call().timeMillis, 1001)
+
+    def testCoroutineThreadsAreReused(self):
+        # When we run several short-lived coroutines one after the other
+        threadsBefore = threading.active_count()
+        for i in range(10):
+            coroutine = Coroutine(TestCoroutine.dummyCoroutineFunc, 1, 2)
+            while coroutine.is_alive():
+                coroutine.call()
+        # They all use the same thread.
+        self.assertTrue( threading.active_count() <= threadsBefore + 1 )
+        self.assertEquals( TestCoroutine.coroutineCalls, [1] * 10 )
+
+    def testThreadPoolLimitsIdleThreads(self):
+        oldPool = Coroutine.threadPool
+        Coroutine.threadPool = CoroutineThreadPool(maxIdleThreads = 2, stackSize = 64*1024)
+        try:
+            # When we run more coroutines at once than the pool keeps
+            coroutines = [Coroutine(TestCoroutine.dummyCoroutineFunc, 1, 2) for i in range(5)]
+            for coroutine in coroutines:
+                coroutine.call()
+                coroutine.call()
+            # Only the maximum number of threads stays in the pool
+            self.assertEquals( len(Coroutine.threadPool.idleThreads), 2 )
+        finally:
+            Coroutine.threadPool = oldPool
+
+    def testDeepRecursionInACoroutineRaisesRuntimeError(self):
+        results = []
+        def recurse(depth):
+            return recurse(depth + 1)
+        def func():
+            try:
+                recurse(0)
+            except RuntimeError:
+                results.append('RuntimeError')
+        # Recursing until Python's limit is reached doesn't overflow the thread's stack.
+        coroutine = Coroutine(func)
+        coroutine.call()
+        self.assertEquals( results, ['RuntimeError'] )
+
     def testCoroutineCanHaveParameters(self):
         def func(*args, **kwargs):
             self.assertEquals(args, (1,))
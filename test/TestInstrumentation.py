@@ -0,0 +1,97 @@
+# Tests for Instrumentation
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.Instrumentation import Histogram, SchedulerStats
+from BrickPython.Scheduler import Scheduler
+from BrickPython.Coroutine import Coroutine
+import BrickPython.Scheduler as SchedulerModule
+import unittest
+from mock import Mock, patch
+
+class TestInstrumentation(unittest.TestCase):
+    'Tests for the timing histograms, and the Scheduler statistics'
+
+    @staticmethod
+    def coroutine(n):
+        for i in range(n):
+            yield
+
+    def setUp(self):
+        self.oldCurrentTimeMillis = Scheduler.currentTimeMillis
+        self.oldTimer = SchedulerStats.timer
+        Scheduler.currentTimeMillis = Mock( side_effect = xrange(0,10000) )
+        SchedulerStats.timer = Mock()
+        SchedulerStats.timer.timeMillis.side_effect = xrange(0,10000) # Each timing is 1ms after the previous one.
+        self.scheduler = Scheduler()
+
+    def tearDown(self):
+        Scheduler.currentTimeMillis = self.oldCurrentTimeMillis
+        SchedulerStats.timer = self.oldTimer
+
+    def testHistogramCountsTimesIntoFixedBuckets(self):
+        histogram = Histogram( (1, 10) )
+        for t in [0.5, 1, 5, 10, 100, 200]:
+            histogram.add( t )
+        self.assertEquals( histogram.buckets, [2, 2, 2] )
+        self.assertEquals( histogram.count, 6 )
+        self.assertEquals( histogram.max, 200 )
+        self.assertAlmostEquals( histogram.mean(), 316.5 / 6 )
+        self.assertEquals( histogram.percentile(50), 10 )
+        self.assertEquals( histogram.percentile(100), 200 )
+
+    def testInstrumentationIsOffByDefault(self):
+        self.scheduler.addActionCoroutine( TestInstrumentation.coroutine(3) )
+        self.scheduler.doWork()
+        self.assertEquals( self.scheduler.stats, None )
+        self.assertFalse( SchedulerStats.timer.timeMillis.called )
+
+    def testSchedulerRecordsWorkCallAndCoroutineTimings(self):
+        stats = self.scheduler.startInstrumentation()
+        coroutine = self.scheduler.addActionCoroutine( TestInstrumentation.coroutine(3) )
+        self.scheduler.doWork()
+        self.scheduler.doWork()
+        coroutineStats = stats.coroutineStats( coroutine )
+        self.assertEquals( coroutineStats.resumeCount, 2 )
+        self.assertEquals( coroutineStats.totalMillis, 2 )
+        self.assertEquals( stats.workCallTimes.count, 2 )
+        self.assertEquals( stats.updateTimes.count, 4 )
+        self.assertEquals( stats.intervals.count, 1 )
+        self.assertEquals( stats.overruns, 0 )
+        # When the coroutine finishes, its timings are combined with others of the same name.
+        self.scheduler.doWork()
+        self.scheduler.doWork()
+        self.assertEquals( stats.coroutineStats( coroutine ), None )
+        self.assertEquals( stats.finishedCoroutines['coroutine'].resumeCount, 4 )
+        self.assertTrue( 'coroutine: resumes=4' in stats.report() )
+
+    def testWorkCallsTakingLongerThanTheIntervalAreCountedAsOverruns(self):
+        stats = self.scheduler.startInstrumentation()
+        stats.timeMillisBetweenWorkCalls = 2
+        self.scheduler.addActionCoroutine( TestInstrumentation.coroutine(3) )
+        self.scheduler.doWork()
+        self.assertEquals( stats.overruns, 1 )
+
+    def testThreadCoroutinesAreCombinedByFunctionName(self):
+        stats = self.scheduler.startInstrumentation()
+        def threadFunction():
+            Coroutine.wait()
+        for i in range(2):
+            self.scheduler.addActionCoroutine( Coroutine(threadFunction) )
+        for i in range(3):
+            self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+        self.assertEquals( stats.finishedCoroutines.keys(), ['threadFunction'] )
+        self.assertEquals( stats.finishedCoroutines['threadFunction'].resumeCount, 4 )
+
+    def testTimingsAreLoggedOnceAtExitHowEverOftenInstrumentationStarts(self):
+        with patch.object(SchedulerModule, 'exitHandlerRegistered', False), patch('atexit.register') as register:
+            self.scheduler.startInstrumentation( logOnExit = True )
+            self.scheduler.startInstrumentation( logOnExit = True )
+            self.assertEquals( register.call_count, 1 )
+            with patch('logging.info') as info:
+                register.call_args[0][0]()
+            self.assertEquals( info.call_count, 1 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -47,6 +47,16 @@ class TestMotor(unittest.TestCase):
         print motor.speed()
         assert( int(motor.speed()) == 1000)
 
+    def testSpeedCalculationFromOversampledPositions(self):
+        motor = self.motor
+        motor.updatePosition(0, 0)
+        # When an update has several readings, the last of them noisy
+        motor.updatePositions( [(10, 10), (20, 20), (30, 30), (40, 44)] )
+        # The speed is fitted to all of them (rather than being 1100 from just the first and last)
+        self.assertEquals( motor.position(), 44 )
+        self.assertAlmostEquals( motor.speed(), 1080.0 )
+        self.assertEquals( len(motor.recentTPs), 4 )
+
     # Tests for positionUsingPIDAlgorithm:
 
     def testGeneratorFunctionWorks(self):
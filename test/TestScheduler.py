@@ -10,9 +10,13 @@
 
 
 from BrickPython.BrickPiWrapper import BrickPiWrapper
-from BrickPython.Scheduler import Scheduler
+from BrickPython.Scheduler import Scheduler, Notifier
+from BrickPython.Sensor import Sensor
+from BrickPython.Coroutine import Coroutine
+from BrickPython.Motor import Motor
 import unittest
 import logging
+import threading
 from mock import *
 
 class TestScheduler(unittest.TestCase):
@@ -161,6 +165,14 @@ class TestScheduler(unittest.TestCase):
         self.scheduler.doWork()
         assert( TestScheduler.coroutineCalls == [10,4,1,11] )
 
+    def testUpdateCoroutineCanBeCalledOncePerWorkCall(self):
+        self.scheduler.setUpdateCoroutine(TestScheduler.dummyCoroutine(10,20))
+        self.scheduler.addActionCoroutine(TestScheduler.dummyCoroutine())
+        self.scheduler.singleUpdatePerWorkCall = True
+        self.scheduler.doWork()
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [10,1,11,2] )
+
     def testWaitMilliseconds(self):
         # If we wait for 10 ms
         for i in self.scheduler.waitMilliseconds(10):
@@ -303,6 +315,234 @@ class TestScheduler(unittest.TestCase):
             pass
         self.assertEquals(self.caught, 1)
 
+    def testGeneratorCoroutinesDontUseThreads(self):
+        # When we run generator coroutines
+        threadsBefore = threading.active_count()
+        for i in range(5):
+            self.scheduler.addActionCoroutine(TestScheduler.dummyCoroutine())
+        self.scheduler.doWork()
+        # No threads are created
+        self.assertEquals( threading.active_count(), threadsBefore )
+        self.assertEquals( TestScheduler.coroutineCalls, [1,1,1,1,1] )
+
+    def testSchedulerRunsThreadCoroutinesToo(self):
+        def threadCoroutineFunc():
+            for i in range(1,3):
+                TestScheduler.coroutineCalls.append(i)
+                Coroutine.wait()
+        # When we schedule both a Coroutine object and a generator
+        coroutine = Coroutine(threadCoroutineFunc)
+        self.scheduler.addActionCoroutine(coroutine, TestScheduler.dummyCoroutine(10,15))
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [1,10] )
+        # Both can be stopped
+        self.scheduler.stopAllCoroutines()
+        self.assertFalse( coroutine.is_alive() )
+        self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+
+    def testSleepingCoroutinesArentInvokedUntilDue(self):
+        Scheduler.currentTimeMillis = Mock( return_value = 0 )
+        scheduler = Scheduler()
+        # When a coroutine waits, passing on the Wakeup hints from waitMilliseconds
+        def sleepingCoroutine():
+            for hint in Scheduler.waitMilliseconds(100):
+                TestScheduler.coroutineCalls.append(1)
+                yield hint
+        scheduler.addActionCoroutine(sleepingCoroutine())
+        for t in range(1, 100, 10):
+            Scheduler.currentTimeMillis.return_value = t
+            scheduler.doWork()
+        # It's only invoked once until it's due
+        self.assertEquals( TestScheduler.coroutineCalls, [1] )
+        # The next work call is requested for when it's due, rather than the full interval
+        self.assertEquals( scheduler.timeMillisToNextCall(), 10 )
+        # And it completes when it's due
+        Scheduler.currentTimeMillis.return_value = 101
+        scheduler.doWork()
+        self.assertEquals( scheduler.numCoroutines(), 0 )
+
+    def testSleepingCoroutinesCanBeTerminated(self):
+        coroutine = self.scheduler.waitMilliseconds(1000)
+        self.scheduler.addActionCoroutine(coroutine)
+        self.scheduler.doWork()
+        self.scheduler.stopCoroutine(coroutine)
+        self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+
+    def testCoroutinesWaitingForNotificationSleepUntilNotified(self):
+        notifier = Notifier()
+        flag = []
+        def waitingCoroutine():
+            for hint in Scheduler.waitForNotification(notifier, lambda: flag != []):
+                TestScheduler.coroutineCalls.append(1)
+                yield hint
+        self.scheduler.addActionCoroutine(waitingCoroutine())
+        for i in range(5):
+            self.scheduler.doWork()
+        # It only runs once while nothing happens
+        self.assertEquals( TestScheduler.coroutineCalls, [1] )
+        # It's woken again by a notification
+        notifier.notify()
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [1,1] )
+        # and finishes when the condition becomes true.
+        flag.append(True)
+        notifier.notify()
+        self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+
+    def testCoroutinesWokenByNotifiersDontAccumulateInTheSleepingHeap(self):
+        Scheduler.currentTimeMillis = Mock( return_value = 0 )
+        scheduler = Scheduler()
+        notifier = Notifier()
+        def waitWithLongTimeouts():
+            while True:
+                for hint in Scheduler.withTimeout(100000, Scheduler.waitForNotification(notifier, lambda: False)):
+                    yield hint
+        scheduler.addActionCoroutine( waitWithLongTimeouts() )
+        # When a coroutine is repeatedly woken early by a busy notifier
+        for t in range(1, 1001):
+            Scheduler.currentTimeMillis.return_value = t
+            scheduler.doWork()
+            notifier.notify()
+        # its cancelled wakeup times don't pile up.
+        self.assertTrue( len(scheduler.sleeping) <= 40 )
+        self.assertEquals( scheduler.numCoroutines(), 1 )
+        self.assertEquals( len(notifier.listeners), 0 )
+
+    def testCoroutinesStopListeningWhenWokenOtherwiseOrStopped(self):
+        Scheduler.currentTimeMillis = Mock( return_value = 1 )
+        scheduler = Scheduler()
+        notifier = Notifier()
+        def waitForNotifier():
+            for hint in Scheduler.waitForNotification(notifier, lambda: False):
+                yield hint
+        # When many coroutines waiting for a notifier time out
+        for i in range(100):
+            scheduler.addActionCoroutine( scheduler.withTimeout(10, waitForNotifier()) )
+        Scheduler.currentTimeMillis.return_value = 2
+        scheduler.doWork()
+        self.assertEquals( len(notifier.listeners), 100 )
+        Scheduler.currentTimeMillis.return_value = 20
+        scheduler.doWork()
+        self.assertEquals( scheduler.numCoroutines(), 0 )
+        # they no longer listen to it
+        self.assertEquals( notifier.listeners, {} )
+        # and nor do stopped ones.
+        coroutine = waitForNotifier()
+        scheduler.addActionCoroutine( coroutine )
+        Scheduler.currentTimeMillis.return_value = 21
+        scheduler.doWork()
+        self.assertEquals( len(notifier.listeners), 1 )
+        scheduler.stopCoroutine( coroutine )
+        self.assertEquals( notifier.listeners, {} )
+
+    def testSensorChangesWakeWaitingCoroutinesInTheSameWorkCall(self):
+        sensor = Sensor('1')
+        def updateCoroutine():
+            for value in [1,1,1,2]:
+                sensor.updateValue(value)
+                yield
+                yield
+        self.scheduler.setUpdateCoroutine(updateCoroutine())
+        self.scheduler.addSensorCoroutine(sensor.waitUntil(lambda value: value == 2))
+        for i in range(3):
+            self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 1 )
+        self.scheduler.doWork()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+
+    def testCoroutinesAreIdentifiedByTheGeneratorAdded(self):
+        coroutines = [TestScheduler.dummyCoroutine() for i in range(2000)]
+        self.scheduler.addActionCoroutine(*coroutines)
+        # The scheduler knows which are running
+        self.assertTrue( self.scheduler.stillRunning( coroutines[1234] ) )
+        self.assertFalse( self.scheduler.stillRunning( TestScheduler.dummyCoroutine() ) )
+        # and stopping one removes it straight away
+        self.scheduler.stopCoroutine( coroutines[1234] )
+        self.assertFalse( self.scheduler.stillRunning( coroutines[1234] ) )
+        self.assertEquals( self.scheduler.numCoroutines(), 1999 )
+        # as does stopping them all.
+        self.scheduler.stopAllCoroutines()
+        self.assertEquals( self.scheduler.numCoroutines(), 0 )
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [] )
+
+    def testCoroutinesRunInPriorityThenDeadlineOrder(self):
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(40,41), Scheduler.PRIORITY_BACKGROUND)
+        self.scheduler.addActionCoroutine(TestScheduler.dummyCoroutine(30,31))
+        self.scheduler.addSensorCoroutine(TestScheduler.dummyCoroutine(20,21))
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(11,12), Scheduler.PRIORITY_CRITICAL)
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(10,11), Scheduler.PRIORITY_CRITICAL, deadlineMillis = 5)
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [10,11,20,30,40] )
+
+    def testMotorControlLoopsAreCriticalHoweverTheyreAdded(self):
+        motor = Motor(0, self.scheduler)
+        @Scheduler.critical
+        def controlLoop():
+            TestScheduler.coroutineCalls.append(10)
+            yield
+        self.scheduler.addSensorCoroutine(TestScheduler.dummyCoroutine(20,21))
+        self.scheduler.addActionCoroutine(controlLoop())
+        move = self.scheduler.addActionCoroutine(motor.moveTo(100))
+        # Coroutines from motors and decorated functions run before the sensor coroutines
+        self.assertEquals( self.scheduler.coroutines[move].priority, Scheduler.PRIORITY_CRITICAL )
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [10,20] )
+        # unless they're given an explicit priority.
+        self.assertEquals( self.scheduler.coroutines[self.scheduler.addCoroutine(motor.setSpeed(100),
+                                                      Scheduler.PRIORITY_BACKGROUND)].priority, Scheduler.PRIORITY_BACKGROUND )
+        self.scheduler.stopAllCoroutines()
+
+    def testMissedDeadlinesAreCounted(self):
+        stats = self.scheduler.startInstrumentation()
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutineThatTakesTime(), Scheduler.PRIORITY_CRITICAL)
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(10,12), deadlineMillis = 5)
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(20,22), deadlineMillis = 100)
+        # When a coroutine takes longer than the deadline for a later one
+        self.scheduler.doWork()
+        # the later one still runs, but its missed deadline is recorded.
+        self.assertEquals( TestScheduler.coroutineCalls, [10,20] )
+        self.assertEquals( stats.deadlinesMissed, 1 )
+        self.assertTrue( "Missed deadlines: 1" in stats.report() )
+
+    def testBackgroundCoroutinesAreSkippedWhenTheWorkCallOverruns(self):
+        self.scheduler.addCoroutine(TestScheduler.dummyCoroutine(40,42), Scheduler.PRIORITY_BACKGROUND)
+        self.scheduler.addActionCoroutine(TestScheduler.dummyCoroutineThatTakesTime())
+        # When the other coroutines take longer than the budget
+        self.scheduler.workCallBudgetMillis = 5
+        self.scheduler.doWork()
+        # the background coroutine doesn't get run
+        self.assertEquals( TestScheduler.coroutineCalls, [] )
+        # but it does get run when there's time.
+        self.scheduler.workCallBudgetMillis = 50
+        self.scheduler.doWork()
+        self.assertEquals( TestScheduler.coroutineCalls, [40] )
+
+    def testCoroutinesWithPeriodsRunAtTheirOwnRate(self):
+        Scheduler.currentTimeMillis = Mock( return_value = 0 )
+        scheduler = Scheduler()
+        calls = {'fast': 0, 'plain': 0, 'slow': 0}
+        def countingCoroutine(name):
+            while True:
+                calls[name] += 1
+                yield
+        # When we add coroutines with periods shorter and longer than the work call interval, and one without a period
+        scheduler.addCoroutine(countingCoroutine('fast'), periodMillis = 10)
+        scheduler.addCoroutine(countingCoroutine('slow'), Scheduler.PRIORITY_BACKGROUND, periodMillis = 500)
+        scheduler.addActionCoroutine(countingCoroutine('plain'))
+        Scheduler.currentTimeMillis.return_value = 10
+        scheduler.doWork()
+        # the scheduler asks for the next work call when the fastest is due
+        self.assertEquals( scheduler.timeMillisToNextCall(), 10 )
+        # and making the work calls when it asks for them, for a second,
+        while Scheduler.currentTimeMillis.return_value < 1010:
+            Scheduler.currentTimeMillis.return_value += scheduler.timeMillisToNextCall()
+            scheduler.doWork()
+        # each runs at its own rate: the one without a period only at the regular work calls.
+        self.assertEquals( calls, {'fast': 101, 'plain': 21, 'slow': 3} )
 
 if __name__ == '__main__':
     logging.basicConfig(format='%(message)s', level=logging.DEBUG) # Logging is a simple print
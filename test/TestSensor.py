@@ -61,6 +61,18 @@ class TestSensor(unittest.TestCase):
         sensor.updateValue( 1000 )
         TestScheduler.TestScheduler.checkCoroutineFinished( coroutine )
 
+    def testCoroutineWaitingForCondition(self):
+        sensor = Sensor( '1' )
+        coroutine = sensor.waitUntil( lambda value: value > 8 )
+        # It yields a hint to wait for the sensor to change
+        hint = coroutine.next()
+        self.assertEquals( hint.notifiers, [sensor.changed] )
+        sensor.updateValue( 5 )
+        coroutine.next()
+        # And finishes when the condition is met.
+        sensor.updateValue( 10 )
+        TestScheduler.TestScheduler.checkCoroutineFinished( coroutine )
+
     def testUltrasonicSensor(self):
         sensor = UltrasonicSensor( '1' )
         self.assertEquals(sensor.port, 0)
@@ -79,6 +91,17 @@ class TestSensor(unittest.TestCase):
         print sensor
         self.assertEquals( sensor.value(), 10 )
 
+    def testOversampledSensorValues(self):
+        sensor = Sensor( '1' )
+        sensor.updateSamples( [4, 0, 8, 6] )
+        self.assertEquals( sensor.samples, [4, 8, 6] )
+        self.assertEquals( (sensor.sampleMin(), sensor.sampleMax(), sensor.sampleMean()), (4, 8, 6.0) )
+        self.assertEquals( sensor.value(), 6 )
+        # The ultrasonic sensor uses the nearest reading of each update.
+        sensor = UltrasonicSensor( '1' )
+        sensor.updateSamples( [255, 12, 255] )
+        self.assertEquals( sensor.value(), 10 )
+
     def testLightSensor(self):
         #Light is 680, dark about 800
         sensor = LightSensor('4')
@@ -0,0 +1,49 @@
+# Tests for TkApplication
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.TkApplication import TkApplication
+import unittest
+from mock import patch
+
+class TestTkApplication(unittest.TestCase):
+    'Tests for TkApplication, using a mock Tk window'
+
+    def testWorkCallIsRescheduledWhenAMotorIsEnabled(self):
+        with patch('BrickPython.TkApplication.tk') as tk:
+            root = tk.Tk.return_value
+            app = TkApplication()
+            app.idleTimeMillisBetweenWorkCalls = 2000
+            app.timerTick()
+            # When idle, the next timer tick is at the idle rate
+            self.assertTrue( root.after.call_args[0][0] > 1000 )
+            pendingTick = root.after.return_value
+            # but enabling a motor replaces it with one at the normal rate.
+            app.motor('A').enable(True)
+            root.after_cancel.assert_called_with( pendingTick )
+            self.assertTrue( root.after.call_args[0][0] <= app.timeMillisBetweenWorkCalls )
+            # So does adding a coroutine.
+            root.after_cancel.reset_mock()
+            app.motor('A').enable(False)
+            app.timerTick()
+            app.addActionCoroutine( app.nullCoroutine() )
+            self.assertTrue( root.after_cancel.called )
+
+    def testWorkCallsDontScheduleTwoTimerTicks(self):
+        with patch('BrickPython.TkApplication.tk') as tk:
+            root = tk.Tk.return_value
+            app = TkApplication()
+            # When a coroutine enables a motor during a timer tick
+            def enableMotor():
+                app.motor('A').enable(True)
+                yield
+            app.addActionCoroutine( enableMotor() )
+            root.after.reset_mock()
+            root.after_cancel.reset_mock()
+            app.timerTick()
+            # only one next tick is scheduled.
+            self.assertEquals( root.after.call_count, 1 )
+            self.assertFalse( root.after_cancel.called )
+
+if __name__ == '__main__':
+    unittest.main()
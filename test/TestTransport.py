@@ -0,0 +1,72 @@
+# Tests for the serial transports
+#
+# Copyright (c) 2014 Charles Weir.  Shared under the MIT Licence.
+
+from BrickPython.Transport import createTransport, Transport, LoopbackTransport, PtyTransport, RawSerialTransport
+import BrickPython.BrickPi as BP
+import unittest
+import os
+from mock import patch
+
+class TestTransport(unittest.TestCase):
+    'Tests for the serial transports, and choosing one'
+
+    @staticmethod
+    def message(data):
+        # Answers a reply message from the BrickPi: checksum, length, then the data.
+        return chr((len(data) + sum(data)) % 256) + chr(len(data)) + ''.join(chr(b) for b in data)
+
+    def testDriverExchangesMessagesOverALoopbackPair(self):
+        transport, board = LoopbackTransport.pair()
+        driver = BP.BrickPiDriver(transport)
+        self.assertEquals( driver.setup(), 0 )
+        driver.tx(1, 2, [BP.MSG_TYPE_VALUES, 9])
+        # The other end receives the message
+        self.assertEquals( board.inWaiting(), 5 )
+        self.assertEquals( board.read(100), '\x01\x0f\x02\x03\x09' )
+        # and its reply is received.
+        board.write( TestTransport.message([BP.MSG_TYPE_VALUES, 7]) )
+        result, count, data = driver.rx(0.01)
+        self.assertEquals( (result, count, list(data)), (0, 2, [BP.MSG_TYPE_VALUES, 7]) )
+
+    def testRawTransportTalksToAPty(self):
+        pty = PtyTransport()
+        pty.open()
+        raw = RawSerialTransport(pty.peerName, 500000)
+        try:
+            raw.open()
+            driver = BP.BrickPiDriver(pty)
+            # Messages go both ways, and the driver waits for them using the file descriptor.
+            raw.write( TestTransport.message([1, 2, 3]) )
+            self.assertEquals( driver.rx(0.1)[:2], (0, 3) )
+            driver.tx(2, 1, [5])
+            self.assertTrue( BP.BrickPiDriver(raw).waitForInput(1) )
+            self.assertEquals( raw.inWaiting(), 4 )
+            self.assertEquals( raw.read(100), '\x02\x08\x01\x05' )
+            self.assertEquals( raw.read(100), '' )
+        finally:
+            raw.close()
+            pty.close()
+        self.assertFalse( pty.isOpen() )
+
+    def testUnconnectedTransportFailsImmediately(self):
+        driver = BP.BrickPiDriver(Transport())
+        self.assertEquals( driver.setup(), -1 )
+        self.assertEquals( driver.rx(10)[0], -1 )
+
+    def testTransportIsChosenByConfiguration(self):
+        with patch.dict(os.environ, {'BRICKPYTHON_TRANSPORT': 'loopback'}):
+            self.assertTrue( isinstance(createTransport(), LoopbackTransport) )
+        with patch.dict(os.environ, {'BRICKPYTHON_TRANSPORT': 'raw', 'BRICKPYTHON_SERIAL_DEVICE': '/dev/ttyUSB1'}):
+            self.assertEquals( createTransport().device, '/dev/ttyUSB1' )
+        # Without configuration, there's no fallback to a mock if the serial device doesn't exist.
+        with patch.dict(os.environ, {'BRICKPYTHON_SERIAL_DEVICE': '/nonexistent'}):
+            os.environ.pop('BRICKPYTHON_TRANSPORT', None)
+            self.assertEquals( createTransport().__class__, Transport )
+        with patch.dict(os.environ, {'BRICKPYTHON_SERIAL_DEVICE': os.devnull}):
+            os.environ.pop('BRICKPYTHON_TRANSPORT', None)
+            self.assertTrue( isinstance(createTransport(), RawSerialTransport) )
+        self.assertRaises( ValueError, createTransport, 'serial' )
+
+if __name__ == '__main__':
+    unittest.main()